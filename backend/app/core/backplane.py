@@ -0,0 +1,110 @@
+import asyncio
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional
+
+from pymongo import ASCENDING
+
+from app.core.config import settings
+
+# A backplane carries WebSocket deliveries between workers/nodes. Each process
+# delivers to its own sockets directly and publishes the same event so the
+# other processes can deliver to theirs. Handlers receive (user_ids, message).
+
+Handler = Callable[[List[str], str], Awaitable[None]]
+
+class Backplane(ABC):
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex
+        self._handler: Optional[Handler] = None
+
+    async def start(self, handler: Handler):
+        self._handler = handler
+
+    async def stop(self):
+        self._handler = None
+
+    @abstractmethod
+    async def publish(self, user_ids: List[str], message: str):
+        ...
+
+# Single process: fans out to the other managers subscribed in this process
+# (if any). With one manager per process this is effectively a no-op.
+class InMemoryBackplane(Backplane):
+    _subscribers: List["InMemoryBackplane"] = []
+
+    async def start(self, handler: Handler):
+        await super().start(handler)
+        InMemoryBackplane._subscribers.append(self)
+
+    async def stop(self):
+        if self in InMemoryBackplane._subscribers:
+            InMemoryBackplane._subscribers.remove(self)
+        await super().stop()
+
+    async def publish(self, user_ids: List[str], message: str):
+        for sub in list(InMemoryBackplane._subscribers):
+            if sub is not self and sub._handler:
+                await sub._handler(user_ids, message)
+
+# Multi worker / multi node: events are inserted into a short-lived collection
+# and every process tails it with a change stream (needs a replica set, which
+# Atlas always is). Events from the local node are skipped, they were already
+# delivered in-process.
+class MongoChangeStreamBackplane(Backplane):
+    def __init__(self, database, collection_name: str = "ws_events", ttl_seconds: int = 60):
+        super().__init__()
+        self.collection = database[collection_name]
+        self.ttl_seconds = ttl_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, handler: Handler):
+        await super().start(handler)
+        await self.collection.create_index(
+            [("created_at", ASCENDING)], expireAfterSeconds=self.ttl_seconds
+        )
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await super().stop()
+
+    async def publish(self, user_ids: List[str], message: str):
+        await self.collection.insert_one({
+            "origin": self.node_id,
+            "user_ids": user_ids,
+            "message": message,
+            "created_at": datetime.utcnow(),
+        })
+
+    async def _watch(self):
+        pipeline = [{"$match": {
+            "operationType": "insert",
+            "fullDocument.origin": {"$ne": self.node_id},
+        }}]
+        resume_token = None
+        while True:
+            try:
+                async with self.collection.watch(pipeline, resume_after=resume_token) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        doc = change["fullDocument"]
+                        if self._handler:
+                            await self._handler(doc["user_ids"], doc["message"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Backplane change stream error, retrying: {e}")
+                await asyncio.sleep(1)
+
+def create_backplane(database) -> Backplane:
+    if settings.WS_BACKPLANE == "mongo":
+        return MongoChangeStreamBackplane(database)
+    return InMemoryBackplane()
@@ -0,0 +1,123 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Generic, Hashable, Iterable, List, Optional, TypeVar
+
+from beanie import PydanticObjectId
+
+from app.core.config import settings
+from app.core.links import to_object_id, to_object_ids
+from app.models.user import User
+
+V = TypeVar("V")
+
+# Small in-process LRU cache with a per-entry TTL. Not thread safe; it is only
+# touched from the event loop.
+class TTLCache(Generic[V]):
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[V]:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: V, ttl: Optional[float] = None):
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+# User documents by id, shared by get_current_user, the page loaders and
+# /users/batch. Every code path that saves a User must call invalidate().
+class UserCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache: TTLCache[User] = TTLCache(maxsize, ttl)
+
+    @staticmethod
+    def _copy(user: User) -> User:
+        return user.model_copy(deep=True)
+
+    # Hits hand out the shared cached instance, which must be treated as read
+    # only. Pass copy=True where the caller may mutate it (current_user).
+    def peek(self, user_id: Any, copy: bool = False) -> Optional[User]:
+        oid = to_object_id(user_id)
+        if oid is None:
+            return None
+        user = self._cache.get(oid)
+        if user is not None and copy:
+            return self._copy(user)
+        return user
+
+    def put(self, user: User):
+        if user is not None and user.id is not None:
+            self._cache.set(user.id, self._copy(user))
+
+    async def get(self, user_id: Any, copy: bool = False) -> Optional[User]:
+        user = self.peek(user_id, copy)
+        if user is not None:
+            return user
+        oid = to_object_id(user_id)
+        if oid is None:
+            return None
+        user = await User.get(oid)
+        self.put(user)
+        return user
+
+    async def get_many(self, user_ids: Iterable[Any]) -> Dict[PydanticObjectId, User]:
+        # Read only: for serializing lists of users
+        found: Dict[PydanticObjectId, User] = {}
+        missing: List[PydanticObjectId] = []
+        for oid in to_object_ids(user_ids):
+            user = self.peek(oid)
+            if user is not None:
+                found[oid] = user
+            else:
+                missing.append(oid)
+        if missing:
+            for user in await User.find({"_id": {"$in": missing}}).to_list():
+                self.put(user)
+                found[user.id] = user
+        return found
+
+    def invalidate(self, *user_ids: Any):
+        for user_id in user_ids:
+            oid = to_object_id(user_id)
+            if oid is not None:
+                self._cache.pop(oid)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
+
+user_cache = UserCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL_SECONDS)
@@ -20,6 +20,74 @@ class Settings(BaseSettings):
     MAIL_PORT: int = 587
     MAIL_SERVER: str = "smtp.gmail.com"
     MAIL_FROM_NAME: str = "Relo Social"
+
+    # Feed / timeline
+    FEED_FANOUT_MAX_FRIENDS: int = 1000
+    FEED_BACKFILL_POSTS: int = 50
+    FEED_MAX_PAGE_SIZE: int = 50
+
+    # In-process User cache (get_current_user, author embedding, /users/batch)
+    USER_CACHE_SIZE: int = 10000
+    USER_CACHE_TTL_SECONDS: int = 60
+
+    # Unread badge counts are served from memory and kept current by the
+    # "unread_counts" events (carried between workers by the backplane); the
+    # TTL only bounds staleness if an event is lost
+    UNREAD_CACHE_TTL_SECONDS: int = 60
+
+    # WebSocket delivery across workers: "memory" (single process) or "mongo" (change streams)
+    WS_BACKPLANE: str = "memory"
+    # Per-connection outbound queue; when full: "drop_oldest" or "disconnect"
+    WS_SEND_QUEUE_SIZE: int = 256
+    WS_SEND_TIMEOUT_SECONDS: float = 10
+    WS_BACKPRESSURE_POLICY: str = "drop_oldest"
+    # Heartbeat, idle reaping and connection caps
+    WS_PING_INTERVAL_SECONDS: float = 25
+    WS_IDLE_TIMEOUT_SECONDS: float = 75
+    WS_MAX_CONNECTIONS_PER_USER: int = 5
+    WS_MAX_CONNECTIONS: int = 50000
+
+    # Uploaded media (served from MEDIA_ROOT at /static)
+    MEDIA_ROOT: str = "static"
+    MEDIA_MAX_UPLOAD_BYTES: int = 100 * 1024 * 1024
+    MEDIA_MAX_AVATAR_BYTES: int = 10 * 1024 * 1024
+    # Processes rendering thumbnails / responsive sizes
+    IMAGE_WORKERS: int = 2
+
+    # Background jobs (notifications, mail); JOB_OUTBOX persists them in MongoDB
+    JOB_WORKERS: int = 4
+    JOB_QUEUE_SIZE: int = 10000
+    JOB_MAX_ATTEMPTS: int = 5
+    JOB_RETRY_BASE_SECONDS: float = 1
+    JOB_OUTBOX: bool = False
+    JOB_LEASE_SECONDS: float = 60
+    JOB_POLL_SECONDS: float = 1
+
+    # Reaction/comment notifications on the same post are merged while unread
+    # and active within this window; their pushes are debounced
+    NOTIFICATION_COALESCE_SECONDS: int = 6 * 3600
+    NOTIFICATION_PUSH_DEBOUNCE_SECONDS: float = 5
+
+    # Password hashing (bcrypt) runs on its own thread pool
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_PENDING: int = 64
+
+    # Verified access token claims cache and deactivated-user refresh
+    TOKEN_CACHE_SIZE: int = 50000
+    TOKEN_CACHE_MAX_TTL_SECONDS: int = 3600
+    AUTH_REVOCATION_REFRESH_SECONDS: int = 60
+
+    # A refresh token presented again within this many seconds of its rotation
+    # (e.g. two app requests racing) is refused without revoking the session
+    REFRESH_REUSE_GRACE_SECONDS: int = 10
+
+    # User search: indexed prefix length and page size cap
+    SEARCH_MAX_PREFIX: int = 15
+    SEARCH_MAX_LIMIT: int = 50
+
+    # Log hot queries that still plan a COLLSCAN at startup
+    INDEX_SCAN_REPORT: bool = True
     
     model_config = SettingsConfigDict(env_file=".env", case_sensitive=True, extra="ignore")
 
@@ -1,29 +1,74 @@
-from typing import Annotated
+import hashlib
+import time
+from typing import Annotated, Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from pydantic import ValidationError
+from beanie import PydanticObjectId
 
 from app.core.config import settings
 from app.models.user import User
+from app.core.cache import TTLCache, user_cache
+from app.core.links import to_object_id
+from app.core.revocation import revocations
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login")
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]) -> User:
-    credentials_exception = HTTPException(
+# Verified access token claims keyed by token hash, kept until the token expires
+# (capped). A repeat request costs a sha256 instead of a JWT verify.
+token_cache = TTLCache(maxsize=settings.TOKEN_CACHE_SIZE, ttl=settings.TOKEN_CACHE_MAX_TTL_SECONDS)
+
+def decode_token(token: str) -> Optional[dict]:
+    # Claims of a valid access token, None otherwise
+    key = hashlib.sha256(token.encode()).hexdigest()
+    claims = token_cache.get(key)
+    if claims is None:
+        try:
+            claims = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        except (JWTError, ValidationError):
+            return None
+        if claims.get("sub") is None or claims.get("type") == "refresh":
+            return None
+        ttl = claims.get("exp", 0) - time.time()
+        if ttl > 0:
+            token_cache.set(key, claims, ttl=min(ttl, settings.TOKEN_CACHE_MAX_TTL_SECONDS))
+    elif claims.get("exp", 0) <= time.time():
+        return None
+    if revocations.is_revoked(claims["sub"], claims):
+        return None
+    return claims
+
+class AuthContext:
+    # The authenticated caller. Routes that only need the id use user_id; the
+    # full User is loaded (through user_cache) only when user() is awaited.
+    def __init__(self, user_id: PydanticObjectId, claims: dict):
+        self.user_id = user_id
+        self.claims = claims
+        self._user: Optional[User] = None
+
+    async def user(self) -> User:
+        if self._user is None:
+            # Own copy: handlers may change current_user in place
+            user = await user_cache.get(self.user_id, copy=True)
+            if user is None or not user.is_active:
+                raise _credentials_exception()
+            self._user = user
+        return self._user
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-    except (JWTError, ValidationError):
-        raise credentials_exception
-        
-    user = await User.get(user_id)
-    if user is None:
-        raise credentials_exception
-    return user
+
+async def get_auth(token: Annotated[str, Depends(oauth2_scheme)]) -> AuthContext:
+    claims = decode_token(token)
+    user_id = to_object_id(claims["sub"]) if claims else None
+    if user_id is None:
+        raise _credentials_exception()
+    return AuthContext(user_id, claims)
+
+async def get_current_user(auth: Annotated[AuthContext, Depends(get_auth)]) -> User:
+    return await auth.user()
@@ -0,0 +1,77 @@
+from datetime import datetime
+from typing import List, Type
+from beanie import Document, PydanticObjectId
+
+from app.models.user import User
+from app.models.post import Post
+from app.models.message import Message, Conversation
+from app.models.notification import Notification
+from app.models.friend_request import FriendRequest
+from app.models.comment import Comment
+from app.models.timeline import TimelineEntry
+from app.models.reaction import PostReaction
+
+# Representative shapes of the hot queries issued by the routers. Only the
+# shape matters for the planner, so placeholder values are used.
+_ID = PydanticObjectId()
+_NOW = datetime.now()
+
+HOT_QUERIES = [
+    (Post, "posts by author", {"author.$id": _ID}, [("created_at", -1), ("_id", -1)]),
+    (TimelineEntry, "home timeline", {"owner_id": _ID}, [("created_at", -1), ("post_id", -1)]),
+    (PostReaction, "viewer reactions on a page", {"user_id": _ID, "post_id": {"$in": [_ID]}}, None),
+    (Message, "messages by conversation", {"conversation_id": _ID}, [("timestamp", -1), ("_id", -1)]),
+    (Comment, "comments by post", {"post_id": _ID}, [("created_at", 1), ("_id", 1)]),
+    (Notification, "notifications by recipient", {"recipient.$id": _ID}, [("created_at", -1), ("_id", -1)]),
+    (Notification, "unread notifications", {"recipient.$id": _ID, "is_read": False}, [("created_at", -1)]),
+    (Notification, "open notification group", {"group_key": ""}, None),
+    (FriendRequest, "pending requests", {"to_user.$id": _ID, "status": "pending"}, None),
+    (FriendRequest, "request between users", {"from_user.$id": _ID, "to_user.$id": _ID, "status": "pending"}, None),
+    (Conversation, "inbox", {"participants.$id": _ID}, [("updated_at", -1)]),
+    (User, "login by username", {"username": ""}, None),
+    (User, "deactivated users", {"is_active": False}, None),
+    (Post, "post search", {"search_terms": {"$all": ["a"]}, "author.$id": {"$in": [_ID]}}, [("created_at", -1), ("_id", -1)]),
+    (Comment, "comment search", {"search_terms": {"$all": ["a"]}, "post_author_id": {"$in": [_ID]}}, [("created_at", -1), ("_id", -1)]),
+    (User, "user search", {"search_keys": {"$all": ["a"]}}, [("created_at", -1), ("_id", -1)]),
+]
+
+async def sync_indexes(models: List[Type[Document]]) -> List[str]:
+    # init_beanie already issues createIndexes for declared indexes; this verifies
+    # they exist and builds any that are missing (e.g. created with other options).
+    missing = []
+    for model in models:
+        collection = model.get_motor_collection()
+        existing = await collection.index_information()
+        for index in getattr(model.Settings, "indexes", []) or []:
+            name = index.document["name"]
+            if name not in existing:
+                await collection.create_indexes([index])
+                missing.append(f"{collection.name}.{name}")
+    return missing
+
+def _plan_stages(plan: dict):
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+async def report_collection_scans() -> List[str]:
+    # Returns the hot queries whose winning plan still contains COLLSCAN
+    scans = []
+    for model, label, query, sort in HOT_QUERIES:
+        collection = model.get_motor_collection()
+        command = {"find": collection.name, "filter": query}
+        if sort:
+            command["sort"] = dict(sort)
+        explain = await collection.database.command(
+            {"explain": command, "verbosity": "queryPlanner"}
+        )
+        winning = explain.get("queryPlanner", {}).get("winningPlan", {})
+        if "COLLSCAN" in set(_plan_stages(winning)):
+            scans.append(f"{collection.name}: {label}")
+    return scans
@@ -0,0 +1,202 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from pymongo import ASCENDING, ReturnDocument
+
+from app.core.config import settings
+
+# In-process job queue for side effects that shouldn't hold up a response
+# (notifications, WebSocket pushes, mail). Handlers are registered by name and
+# called with the enqueued keyword arguments; a handler that raises is retried
+# with exponential backoff up to JOB_MAX_ATTEMPTS.
+#
+# With JOB_OUTBOX enabled jobs are first written to a MongoDB collection and
+# claimed from there by the workers of every process, so they survive a
+# restart. Payloads must then be BSON friendly (ids as strings).
+
+Handler = Callable[..., Awaitable[Any]]
+
+PENDING = "pending"
+RUNNING = "running"
+FAILED = "failed"
+
+class Job:
+    def __init__(self, name: str, payload: Dict[str, Any], attempts: int = 0, id: Any = None):
+        self.name = name
+        self.payload = payload
+        self.attempts = attempts
+        self.id = id
+
+class JobQueue:
+    def __init__(self):
+        self.handlers: Dict[str, Handler] = {}
+        self.queue: Optional[asyncio.Queue] = None
+        self.outbox = None
+        self._workers: Set[asyncio.Task] = set()
+        self._retries: Set[asyncio.Task] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self.node_id = uuid.uuid4().hex
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self._running = 0
+
+    def handler(self, name: str):
+        def register(fn: Handler) -> Handler:
+            self.handlers[name] = fn
+            return fn
+        return register
+
+    async def start(self, database=None):
+        self.queue = asyncio.Queue(maxsize=settings.JOB_QUEUE_SIZE)
+        self._wakeup = asyncio.Event()
+        if settings.JOB_OUTBOX and database is not None:
+            self.outbox = database["job_outbox"]
+            await self.outbox.create_index([("status", ASCENDING), ("run_at", ASCENDING)])
+        for _ in range(settings.JOB_WORKERS):
+            worker = self._outbox_worker() if self.outbox is not None else self._worker()
+            task = asyncio.create_task(worker)
+            self._workers.add(task)
+
+    async def stop(self):
+        for task in list(self._workers) + list(self._retries):
+            task.cancel()
+        await asyncio.gather(*self._workers, *self._retries, return_exceptions=True)
+        self._workers.clear()
+        self._retries.clear()
+
+    async def enqueue(self, name: str, **payload):
+        if name not in self.handlers:
+            raise ValueError(f"Unknown job: {name}")
+        if self.outbox is not None:
+            await self.outbox.insert_one({
+                "name": name,
+                "payload": payload,
+                "status": PENDING,
+                "attempts": 0,
+                "run_at": datetime.utcnow(),
+                "created_at": datetime.utcnow(),
+            })
+            self._wakeup.set()
+            return
+        if self.queue is None:
+            # Not started (scripts, shell): run inline
+            await self.handlers[name](**payload)
+            return
+        # Waits only if the queue is full, which bounds memory under bursts
+        await self.queue.put(Job(name, payload))
+
+    def _backoff(self, attempts: int) -> float:
+        return settings.JOB_RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+
+    async def _run(self, job: Job) -> Optional[str]:
+        # Returns None on success, the error message otherwise
+        handler = self.handlers.get(job.name)
+        if handler is None:
+            return f"No handler for {job.name}"
+        job.attempts += 1
+        self._running += 1
+        try:
+            await handler(**job.payload)
+            self.completed += 1
+            return None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return str(e) or e.__class__.__name__
+        finally:
+            self._running -= 1
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            error = await self._run(job)
+            if error is None:
+                continue
+            if job.attempts >= settings.JOB_MAX_ATTEMPTS:
+                self.failed += 1
+                print(f"Job {job.name} failed after {job.attempts} attempts: {error}")
+                continue
+            self.retried += 1
+            task = asyncio.create_task(self._retry_later(job, self._backoff(job.attempts)))
+            self._retries.add(task)
+            task.add_done_callback(self._retries.discard)
+
+    async def _retry_later(self, job: Job, delay: float):
+        await asyncio.sleep(delay)
+        await self.queue.put(job)
+
+    async def _claim(self) -> Optional[Job]:
+        now = datetime.utcnow()
+        doc = await self.outbox.find_one_and_update(
+            {"$or": [
+                {"status": PENDING, "run_at": {"$lte": now}},
+                # Lease expired: the worker that claimed it died
+                {"status": RUNNING, "run_at": {"$lte": now}},
+            ]},
+            {"$set": {
+                "status": RUNNING,
+                "owner": self.node_id,
+                "run_at": now + timedelta(seconds=settings.JOB_LEASE_SECONDS),
+            }},
+            sort=[("run_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc is None:
+            return None
+        return Job(doc["name"], doc.get("payload") or {}, doc.get("attempts", 0), doc["_id"])
+
+    async def _outbox_worker(self):
+        while True:
+            try:
+                job = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Job outbox error, retrying: {e}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            error = await self._run(job)
+            try:
+                if error is None:
+                    await self.outbox.delete_one({"_id": job.id})
+                elif job.attempts >= settings.JOB_MAX_ATTEMPTS:
+                    self.failed += 1
+                    print(f"Job {job.name} failed after {job.attempts} attempts: {error}")
+                    await self.outbox.update_one({"_id": job.id}, {"$set": {
+                        "status": FAILED, "attempts": job.attempts, "last_error": error
+                    }})
+                else:
+                    self.retried += 1
+                    delay = self._backoff(job.attempts)
+                    await self.outbox.update_one({"_id": job.id}, {"$set": {
+                        "status": PENDING,
+                        "attempts": job.attempts,
+                        "last_error": error,
+                        "run_at": datetime.utcnow() + timedelta(seconds=delay),
+                    }})
+            except Exception as e:
+                # The lease expires and another worker picks the job up again
+                print(f"Job outbox update failed for {job.name}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "backend": "mongo" if self.outbox is not None else "memory",
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "running": self._running,
+            "waiting_retry": len(self._retries),
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+jobs = JobQueue()
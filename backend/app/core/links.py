@@ -0,0 +1,39 @@
+from typing import Any, Iterable, List, Optional
+from beanie import Link, PydanticObjectId
+
+# Beanie stores Link[...] fields as DBRefs, so the referenced id lives under
+# "<field>.$id". These helpers build those filters (index friendly, see
+# app.core.indexes) and read ids from links whether or not they were fetched.
+
+def to_object_id(value: Any) -> Optional[PydanticObjectId]:
+    if isinstance(value, PydanticObjectId):
+        return value
+    try:
+        return PydanticObjectId(str(value))
+    except Exception:
+        return None
+
+def to_object_ids(values: Iterable[Any]) -> List[PydanticObjectId]:
+    result = []
+    for value in values:
+        oid = to_object_id(value)
+        if oid is not None:
+            result.append(oid)
+    return result
+
+def link_eq(field: str, value: Any) -> dict:
+    return {f"{field}.$id": to_object_id(value)}
+
+def link_in(field: str, values: Iterable[Any]) -> dict:
+    return {f"{field}.$id": {"$in": to_object_ids(values)}}
+
+def link_all(field: str, values: Iterable[Any]) -> dict:
+    return {f"{field}.$id": {"$all": to_object_ids(values)}}
+
+def link_id(value: Any) -> Optional[PydanticObjectId]:
+    # Works for an unfetched Link, a fetched Document or a raw DBRef
+    if value is None:
+        return None
+    if isinstance(value, Link):
+        return value.ref.id
+    return getattr(value, "id", None)
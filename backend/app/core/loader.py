@@ -0,0 +1,64 @@
+from typing import Any, Dict, Generic, Iterable, List, Optional, Set, Type, TypeVar
+from beanie import Document, PydanticObjectId
+
+from app.core.links import link_id
+
+DocT = TypeVar("DocT", bound=Document)
+
+# Request-scoped batch loader for linked documents: collect every referenced
+# id on a page with add(), resolve them with a single $in query in load(),
+# then read them back with get() while serializing.
+class DocumentLoader(Generic[DocT]):
+    def __init__(self, model: Type[DocT], cache: Any = None):
+        self.model = model
+        # Optional cache exposing peek(id) / put(doc), e.g. app.core.cache.user_cache.
+        # Loaded documents are only read while serializing, so cache hits are shared
+        self.cache = cache
+        self._docs: Dict[PydanticObjectId, DocT] = {}
+        self._pending: Set[PydanticObjectId] = set()
+
+    def add(self, *refs: Any):
+        for ref in refs:
+            if ref is None:
+                continue
+            # Already fetched documents are kept as-is, no query needed
+            if isinstance(ref, self.model):
+                self._docs.setdefault(ref.id, ref)
+                continue
+            oid = link_id(ref)
+            if oid is not None and oid not in self._docs:
+                self._pending.add(oid)
+
+    def add_many(self, refs: Iterable[Any]):
+        self.add(*refs)
+
+    async def load(self) -> Dict[PydanticObjectId, DocT]:
+        pending = [oid for oid in self._pending if oid not in self._docs]
+        self._pending.clear()
+        if self.cache is not None:
+            missing = []
+            for oid in pending:
+                doc = self.cache.peek(oid)
+                if doc is not None:
+                    self._docs[oid] = doc
+                else:
+                    missing.append(oid)
+            pending = missing
+        if pending:
+            docs = await self.model.find({"_id": {"$in": pending}}).to_list()
+            for doc in docs:
+                self._docs[doc.id] = doc
+                if self.cache is not None:
+                    self.cache.put(doc)
+        return self._docs
+
+    def get(self, ref: Any) -> Optional[DocT]:
+        if ref is None:
+            return None
+        if isinstance(ref, self.model):
+            return self._docs.get(ref.id, ref)
+        oid = link_id(ref)
+        return self._docs.get(oid) if oid is not None else None
+
+    def values(self) -> List[DocT]:
+        return list(self._docs.values())
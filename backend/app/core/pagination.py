@@ -0,0 +1,44 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Callable, Optional, Tuple
+from beanie import PydanticObjectId
+from fastapi import HTTPException, Response
+
+# Opaque keyset cursor: urlsafe base64 of [iso timestamp, object id].
+# Pages are ordered by (sort field, _id) so ties on the timestamp stay stable.
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(value: datetime, doc_id: Any) -> str:
+    raw = json.dumps([value.isoformat(), str(doc_id)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, PydanticObjectId]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, doc_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(value), PydanticObjectId(doc_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_filter(field: str, cursor: Optional[str], descending: bool = True, id_field: str = "_id") -> dict:
+    if not cursor:
+        return {}
+    value, doc_id = decode_cursor(cursor)
+    op = "$lt" if descending else "$gt"
+    return {
+        "$or": [
+            {field: {op: value}},
+            {field: value, id_field: {op: doc_id}},
+        ]
+    }
+
+def set_next_cursor(response: Response, items: list, limit: int, key: Callable[[Any], Tuple[datetime, Any]]) -> Optional[str]:
+    # Only a full page can have a next page
+    if not items or len(items) < limit:
+        return None
+    value, doc_id = key(items[-1])
+    cursor = encode_cursor(value, doc_id)
+    response.headers[NEXT_CURSOR_HEADER] = cursor
+    return cursor
@@ -0,0 +1,307 @@
+import asyncio
+import json
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from fastapi import WebSocket
+
+from app.core.backplane import Backplane
+from app.core.config import settings
+from app.core.revocation import revocations
+
+try:
+    import orjson
+except ImportError: # optional, falls back to json
+    orjson = None
+
+DROP_OLDEST = "drop_oldest"
+DISCONNECT = "disconnect"
+
+# Close codes (4000-4999 are application defined). 1008 is avoided on purpose:
+# the app treats it as an auth failure and logs the user out.
+CLOSE_TRY_AGAIN = 1013
+CLOSE_IDLE_TIMEOUT = 4000
+CLOSE_REPLACED = 4001
+# Session revoked (logout, refresh token reuse): this one should log the app out
+CLOSE_REVOKED = 1008
+
+def encode_frame(event_type: str, payload: dict) -> str:
+    # Serialize a {"type", "payload"} event once; the resulting str is shared by
+    # every recipient queue (no per-recipient json.dumps or copies)
+    event = {"type": event_type, "payload": payload}
+    if orjson is not None:
+        return orjson.dumps(event, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+    # Compact like orjson, so every frame starts with '{"type":"<event>"'
+    return json.dumps(event, ensure_ascii=False, default=str, separators=(",", ":"))
+
+# Called with (user_ids, payload) for frames of one event type
+Listener = Callable[[List[str], dict], None]
+
+class RealtimeMetrics:
+    def __init__(self):
+        self.enqueued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.slow_disconnects = 0
+        self.send_errors = 0
+        self.idle_reaped = 0
+        self.replaced = 0
+        self.rejected = 0
+        self._latency_total = 0.0
+        self.latency_max = 0.0
+
+    def record_send(self, latency: float):
+        self.sent += 1
+        self._latency_total += latency
+        if latency > self.latency_max:
+            self.latency_max = latency
+
+    def snapshot(self) -> dict:
+        return {
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "slow_disconnects": self.slow_disconnects,
+            "send_errors": self.send_errors,
+            "idle_reaped": self.idle_reaped,
+            "replaced": self.replaced,
+            "rejected": self.rejected,
+            # enqueue -> written to the socket
+            "send_latency_avg_ms": round(self._latency_total / self.sent * 1000, 2) if self.sent else 0.0,
+            "send_latency_max_ms": round(self.latency_max * 1000, 2),
+        }
+
+# One per socket: a bounded outbound queue drained by its own writer task, so a
+# slow or half-dead peer only ever delays itself.
+class Connection:
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: str,
+        manager: "ConnectionManager",
+        family_id: Optional[str] = None
+    ):
+        self.websocket = websocket
+        self.user_id = user_id
+        # Login session the socket authenticated with (token "fam" claim)
+        self.family_id = family_id
+        self.manager = manager
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
+        self.closed = False
+        self._writer: Optional[asyncio.Task] = None
+        self.connected_at = time.monotonic()
+        self.last_seen = self.connected_at
+        # Set once the client has sent anything (e.g. a pong). Idle timeouts only
+        # apply to such clients; silent legacy clients rely on send failures and
+        # the server's protocol-level pings.
+        self.responsive = False
+
+    def is_revoked(self) -> bool:
+        return revocations.is_revoked(self.user_id, {"fam": self.family_id})
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, message: str) -> bool:
+        if self.closed:
+            return False
+        item = (message, time.perf_counter())
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if settings.WS_BACKPRESSURE_POLICY == DISCONNECT:
+                self.manager.metrics.slow_disconnects += 1
+                self.evict(CLOSE_TRY_AGAIN)
+                return False
+            # drop_oldest: the newest event is usually the most relevant one
+            self.queue.get_nowait()
+            self.queue.put_nowait(item)
+            self.manager.metrics.dropped += 1
+        self.manager.metrics.enqueued += 1
+        return True
+
+    async def _write_loop(self):
+        while not self.closed:
+            message, enqueued_at = await self.queue.get()
+            try:
+                await asyncio.wait_for(
+                    self.websocket.send_text(message),
+                    timeout=settings.WS_SEND_TIMEOUT_SECONDS
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Dead or stuck peer: drop it so later fan-outs skip it
+                self.manager.metrics.send_errors += 1
+                self.manager.disconnect(self.websocket, self.user_id)
+                await self._close(code=1011)
+                return
+            self.manager.metrics.record_send(time.perf_counter() - enqueued_at)
+
+    async def _close(self, code: int = 1000):
+        self.closed = True
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+    def evict(self, code: int):
+        self.manager.disconnect(self.websocket, self.user_id)
+        asyncio.create_task(self._close(code=code))
+
+    def stop(self):
+        self.closed = True
+        if self._writer and not self._writer.done() and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+
+# WebSocket Manager
+class ConnectionManager:
+    def __init__(self):
+        # Every device of a user keeps its own connection; dicts/sets give O(1) add/remove
+        self.active_connections: Dict[WebSocket, Connection] = {}
+        self.user_connections: Dict[str, Set[Connection]] = {} # user_id -> connections
+        self.backplane: Optional[Backplane] = None
+        self.metrics = RealtimeMetrics()
+        self._reaper: Optional[asyncio.Task] = None
+        self._listeners: List[Tuple[str, Listener]] = []
+
+    async def start(self, backplane: Backplane):
+        self.backplane = backplane
+        await backplane.start(self.deliver_local)
+        self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def stop(self):
+        if self._reaper:
+            self._reaper.cancel()
+            self._reaper = None
+        for conn in list(self.active_connections.values()):
+            conn.stop()
+        if self.backplane:
+            await self.backplane.stop()
+            self.backplane = None
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        user_id: str,
+        family_id: Optional[str] = None
+    ) -> Optional[Connection]:
+        # Node-wide cap keeps memory per node bounded; refuse before accepting
+        if len(self.active_connections) >= settings.WS_MAX_CONNECTIONS:
+            self.metrics.rejected += 1
+            await websocket.close(code=CLOSE_TRY_AGAIN)
+            return None
+
+        await websocket.accept()
+
+        # Per-user cap: the oldest device socket is usually the stale one
+        conns = self.user_connections.get(user_id, set())
+        while len(conns) >= settings.WS_MAX_CONNECTIONS_PER_USER:
+            oldest = min(conns, key=lambda c: c.connected_at)
+            self.metrics.replaced += 1
+            oldest.evict(CLOSE_REPLACED)
+
+        conn = Connection(websocket, user_id, self, family_id)
+        conn.start()
+        self.active_connections[websocket] = conn
+        self.user_connections.setdefault(user_id, set()).add(conn)
+        return conn
+
+    def mark_seen(self, websocket: WebSocket):
+        conn = self.active_connections.get(websocket)
+        if conn is not None:
+            conn.last_seen = time.monotonic()
+            conn.responsive = True
+
+    async def _reap_loop(self):
+        # Heartbeat + reaper: ping quiet sockets, evict the ones that stopped answering
+        while True:
+            await asyncio.sleep(settings.WS_PING_INTERVAL_SECONDS)
+            try:
+                self._reap()
+            except Exception as e:
+                print(f"WebSocket reaper error: {e}")
+
+    def _reap(self):
+        now = time.monotonic()
+        ping = None
+        for conn in list(self.active_connections.values()):
+            idle = now - conn.last_seen
+            if conn.is_revoked():
+                # Revoked on another worker; picked up with the revocation refresh
+                conn.evict(CLOSE_REVOKED)
+            elif conn.responsive and idle > settings.WS_IDLE_TIMEOUT_SECONDS:
+                self.metrics.idle_reaped += 1
+                conn.evict(CLOSE_IDLE_TIMEOUT)
+            elif idle >= settings.WS_PING_INTERVAL_SECONDS:
+                if ping is None:
+                    ping = encode_frame("ping", {"ts": int(time.time())})
+                conn.enqueue(ping)
+
+    def disconnect(self, websocket: WebSocket, user_id: str):
+        conn = self.active_connections.pop(websocket, None)
+        if conn is None:
+            return
+        conn.stop()
+        conns = self.user_connections.get(user_id)
+        if conns is not None:
+            # Only this socket; a newer device of the same user stays registered
+            conns.discard(conn)
+            if not conns:
+                del self.user_connections[user_id]
+
+    def close_family(self, family_id):
+        # Sockets of a revoked session held by this process; other workers
+        # drop theirs on their next reaper pass or inbound frame
+        family_id = str(family_id)
+        for conn in list(self.active_connections.values()):
+            if conn.family_id == family_id:
+                conn.evict(CLOSE_REVOKED)
+
+    def subscribe(self, event_type: str, listener: Listener):
+        # In-process consumers of an event (e.g. caches kept current by it). They
+        # see every such frame this process delivers, backplane ones included,
+        # whether or not the users have a socket here.
+        self._listeners.append((f'{{"type":"{event_type}"', listener))
+
+    async def deliver_local(self, user_ids: List[str], message: str):
+        # Sockets held by this process only. Enqueue and return: the writer
+        # tasks do the actual sends concurrently.
+        for prefix, listener in self._listeners:
+            if message.startswith(prefix):
+                try:
+                    listener(user_ids, json.loads(message)["payload"])
+                except Exception as e:
+                    print(f"WebSocket listener error: {e}")
+        for user_id in user_ids:
+            for conn in list(self.user_connections.get(user_id, ())):
+                conn.enqueue(message)
+
+    async def broadcast(self, frame: str, user_ids: Iterable[str]):
+        # frame is already encoded (see encode_frame) and sent as-is to every device
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids:
+            return
+        await self.deliver_local(user_ids, frame)
+        # Other workers/nodes may hold these users' sockets; one event for all
+        if self.backplane:
+            await self.backplane.publish(user_ids, frame)
+
+    async def send_personal_message(self, message: str, user_id: str):
+        await self.broadcast(message, [user_id])
+
+    def connection_count(self, user_id: Optional[str] = None) -> int:
+        if user_id is not None:
+            return len(self.user_connections.get(user_id, ()))
+        return len(self.active_connections)
+
+    def stats(self) -> dict:
+        depths = [conn.queue.qsize() for conn in self.active_connections.values()]
+        return {
+            "connections": len(self.active_connections),
+            "users": len(self.user_connections),
+            "queue_depth_total": sum(depths),
+            "queue_depth_max": max(depths) if depths else 0,
+            **self.metrics.snapshot(),
+        }
+
+manager = ConnectionManager()
@@ -0,0 +1,56 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional, Set
+
+from app.core.config import settings
+from app.models.user import User
+from app.models.session import TokenFamily
+
+# Small in-memory view of who may no longer authenticate, so the request path
+# can check access tokens without reading the user document. Loaded at
+# startup and refreshed periodically (other workers may change it); session
+# revocations made by this process apply immediately.
+class RevocationSet:
+    def __init__(self):
+        self.users: Set[str] = set() # deactivated user ids
+        # Sessions revoked (logout, refresh token reuse) recently enough that
+        # their access tokens may still be unexpired
+        self.families: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    async def load(self):
+        inactive = await User.get_motor_collection().find(
+            {"is_active": False}, {"_id": 1}
+        ).to_list(length=None)
+        self.users = {str(doc["_id"]) for doc in inactive}
+        since = datetime.utcnow() - timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+        revoked = await TokenFamily.get_motor_collection().find(
+            {"revoked": True, "revoked_at": {"$gte": since}}, {"_id": 1}
+        ).to_list(length=None)
+        self.families = {str(doc["_id"]) for doc in revoked}
+
+    async def start(self):
+        await self.load()
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(settings.AUTH_REVOCATION_REFRESH_SECONDS)
+            try:
+                await self.load()
+            except Exception as e:
+                print(f"Revocation refresh failed: {e}")
+
+    def revoke_family(self, family_id):
+        self.families.add(str(family_id))
+
+    def is_revoked(self, user_id: str, claims: dict) -> bool:
+        # Two set lookups, no I/O
+        return user_id in self.users or claims.get("fam") in self.families
+
+revocations = RevocationSet()
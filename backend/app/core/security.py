@@ -1,12 +1,24 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Union, Any
-from jose import jwt
+from typing import Optional, Tuple, Union, Any
+from fastapi import HTTPException
+from jose import jwt, JWTError
 from passlib.context import CryptContext
 from app.core.config import settings
 
 from passlib.exc import UnknownHashError
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# min/max pin the cost: hashes made with other rounds report needs_update and
+# are rehashed on the next successful login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.BCRYPT_ROUNDS,
+)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     try:
@@ -19,22 +31,122 @@ def get_password_hash(password: str) -> str:
     # Đảm bảo mật khẩu luôn được băm đúng định dạng bcrypt
     return pwd_context.hash(password)
 
-def create_access_token(subject: Union[str, Any], expires_delta: Optional[timedelta] = None) -> str:
+def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    try:
+        return pwd_context.verify_and_update(plain_password, hashed_password)
+    except (UnknownHashError, ValueError):
+        return False, None
+
+# bcrypt takes 100-300 ms of CPU per call. Handlers use the async wrappers below,
+# which run it on a small dedicated thread pool (bcrypt releases the GIL) so
+# the event loop keeps serving sockets and other requests. Calls beyond
+# PASSWORD_HASH_MAX_PENDING are refused with 503 instead of queueing for
+# seconds during a login storm.
+
+class PasswordHashMetrics:
+    def __init__(self):
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self._queue_total = 0.0
+        self.queue_max = 0.0
+        self._run_total = 0.0
+
+    def record(self, queued: float, ran: float):
+        self.completed += 1
+        self._queue_total += queued
+        self._run_total += ran
+        if queued > self.queue_max:
+            self.queue_max = queued
+
+    def snapshot(self) -> dict:
+        n = self.completed
+        return {
+            "completed": n,
+            "pending": _pending,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "queue_avg_ms": round(self._queue_total / n * 1000, 2) if n else 0.0,
+            "queue_max_ms": round(self.queue_max * 1000, 2),
+            "run_avg_ms": round(self._run_total / n * 1000, 2) if n else 0.0,
+        }
+
+hash_metrics = PasswordHashMetrics()
+_executor: Optional[ThreadPoolExecutor] = None
+_pending = 0
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+        )
+    return _executor
+
+async def _offload(fn, *args):
+    global _pending
+    if _pending >= settings.PASSWORD_HASH_MAX_PENDING:
+        hash_metrics.rejected += 1
+        raise HTTPException(
+            status_code=503,
+            detail="Máy chủ đang bận, vui lòng thử lại.",
+            headers={"Retry-After": "1"}
+        )
+
+    def timed():
+        started = time.perf_counter()
+        return started, fn(*args), time.perf_counter()
+
+    _pending += 1
+    submitted = time.perf_counter()
+    try:
+        started, result, finished = await asyncio.get_running_loop().run_in_executor(_get_executor(), timed)
+    finally:
+        _pending -= 1
+    hash_metrics.record(started - submitted, finished - started)
+    return result
+
+async def hash_password_async(password: str) -> str:
+    return await _offload(get_password_hash, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _offload(verify_password, plain_password, hashed_password)
+
+async def verify_and_update_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    # (valid, new_hash): new_hash is set when the stored hash uses outdated parameters
+    return await _offload(verify_and_update, plain_password, hashed_password)
+
+def create_access_token(
+    subject: Union[str, Any],
+    expires_delta: Optional[timedelta] = None,
+    family_id: Optional[str] = None
+) -> str:
     if expires_delta:
         expire = datetime.now(timezone.utc) + expires_delta
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     
     to_encode = {"exp": expire, "sub": str(subject), "type": "access"}
+    if family_id:
+        # Lets logout revoke the session's access tokens too
+        to_encode["fam"] = family_id
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-def create_refresh_token(subject: Union[str, Any], expires_delta: Optional[timedelta] = None) -> str:
+def create_refresh_token(
+    subject: Union[str, Any],
+    expires_delta: Optional[timedelta] = None,
+    family_id: Optional[str] = None,
+    jti: Optional[str] = None
+) -> str:
     if expires_delta:
         expire = datetime.now(timezone.utc) + expires_delta
     else:
         expire = datetime.now(timezone.utc) + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
     
     to_encode = {"exp": expire, "sub": str(subject), "type": "refresh"}
+    if family_id:
+        to_encode["fam"] = family_id
+        to_encode["jti"] = jti
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
@@ -0,0 +1,91 @@
+import mimetypes
+import os
+import re
+from typing import Dict
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+
+# /static with caching that matches how media is stored. Files under media/ are
+# content addressed (app.services.media), so their URL never changes meaning:
+# strong ETag from the hash and a year-long immutable Cache-Control. Anything
+# else (legacy uploads, overwritten in place) must be revalidated.
+# FileResponse answers Range / If-Range requests itself (206, 416), which is
+# what video and voice message seeking relies on.
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"
+
+# Precompressed siblings served when the client accepts them, best first
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
+_CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{64}(\.[a-z0-9]+)*$")
+
+def _accepted_encodings(header: str) -> Dict[str, float]:
+    # "gzip;q=0.5, br, *;q=0" -> {"gzip": 0.5, "br": 1.0, "*": 0.0}
+    accepted = {}
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[token] = q
+    return accepted
+
+def _quality(accepted: Dict[str, float], encoding: str) -> float:
+    if encoding in accepted:
+        return accepted[encoding]
+    return accepted.get("*", 0.0)
+
+class MediaStaticFiles(StaticFiles):
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        name = os.path.basename(full_path)
+        media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+        headers = {}
+        if _CONTENT_ADDRESSED.match(name):
+            headers["cache-control"] = IMMUTABLE_CACHE
+            headers["etag"] = f'"{name}"'
+        else:
+            headers["cache-control"] = REVALIDATE_CACHE
+
+        path = full_path
+        compressed = [
+            (encoding, f"{full_path}{suffix}") for encoding, suffix in PRECOMPRESSED
+            if os.path.isfile(f"{full_path}{suffix}")
+        ]
+        if compressed:
+            headers["vary"] = "Accept-Encoding"
+            accepted = _accepted_encodings(request_headers.get("accept-encoding", ""))
+            # Highest q wins; on a tie PRECOMPRESSED order (br first) decides
+            ranked = sorted(compressed, key=lambda c: _quality(accepted, c[0]), reverse=True)
+            for encoding, candidate in ranked:
+                if _quality(accepted, encoding) > 0:
+                    path = candidate
+                    stat_result = os.stat(candidate)
+                    headers["content-encoding"] = encoding
+                    if "etag" in headers:
+                        headers["etag"] = f'"{name}-{encoding}"'
+                    break
+
+        response = FileResponse(
+            path,
+            status_code=status_code,
+            headers=headers,
+            media_type=media_type,
+            stat_result=stat_result
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
@@ -0,0 +1,27 @@
+import re
+import unicodedata
+from typing import Iterable, List
+
+# Text normalization shared by the search indexes. Vietnamese is written with
+# stacked diacritics ("Nguyễn Văn Đức"); folding strips them so "nguyen van
+# duc", "Nguyễn" and "NGUYEN" all meet on the same keys.
+
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+def fold(text: str) -> str:
+    text = unicodedata.normalize("NFD", text or "")
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    # đ/Đ is a separate letter, not d + a combining mark
+    return text.replace("đ", "d").replace("Đ", "D").lower()
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _NON_WORD.split(fold(text)) if token]
+
+def edge_ngrams(tokens: Iterable[str], max_length: int) -> List[str]:
+    # "duc" -> ["d", "du", "duc"]; lets an anchored equality lookup on a
+    # multikey index answer prefix queries
+    keys = set()
+    for token in tokens:
+        for n in range(1, min(len(token), max_length) + 1):
+            keys.add(token[:n])
+    return sorted(keys)
@@ -0,0 +1,23 @@
+from typing import Dict, Optional
+
+# Resized variants of an uploaded image live next to the original, e.g.
+#   media/<sha256>.jpg -> media/<sha256>.thumb.webp, media/<sha256>.small.webp
+# Documents store only the variant file names, so URLs follow whatever host
+# the original URL was issued for.
+
+def media_filename(url: Optional[str]) -> Optional[str]:
+    if not url:
+        return None
+    return url.rsplit("/", 1)[-1] or None
+
+def content_key(url: Optional[str]) -> Optional[str]:
+    # The content hash of a media URL (file name up to the first dot)
+    name = media_filename(url)
+    return name.split(".", 1)[0] if name else None
+
+def variant_urls(url: Optional[str], names: Optional[Dict[str, str]]) -> Dict[str, str]:
+    if not url or not names:
+        return {}
+    base = url.rsplit("/", 1)[0]
+    # Already resolved names (containing a "/") are kept as they are
+    return {size: name if "/" in name else f"{base}/{name}" for size, name in names.items()}
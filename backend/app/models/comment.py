@@ -1,17 +1,27 @@
-from typing import Optional
+from typing import List, Optional
 from beanie import Document, Link, PydanticObjectId
 from pydantic import BaseModel, Field, ConfigDict
 from datetime import datetime
+from pymongo import IndexModel, ASCENDING, DESCENDING
 from app.models.user import User, UserOut
+from app.core.loader import DocumentLoader
 
 class Comment(Document):
     post_id: PydanticObjectId
     author: Link[User]
     content: str
     created_at: datetime = Field(default_factory=datetime.now)
+    # Search (app.services.search): folded terms, and the post's author so
+    # results can be limited to posts the viewer may see
+    search_terms: List[str] = Field(default_factory=list)
+    post_author_id: Optional[PydanticObjectId] = None
 
     class Settings:
         name = "comments"
+        indexes = [
+            IndexModel([("post_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)]),
+            IndexModel([("search_terms", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        ]
 
 class CommentOut(BaseModel):
     id: str = Field(validation_alias="id")
@@ -26,8 +36,10 @@ class CommentOut(BaseModel):
     )
 
     @classmethod
-    def from_doc(cls, doc: Comment) -> "CommentOut":
-        author_data = doc.author
+    def from_doc(cls, doc: Comment, users: Optional[DocumentLoader] = None) -> "CommentOut":
+        author_data = (users.get(doc.author) if users else None) or doc.author
+        if isinstance(author_data, Link):
+            author_data = author_data.ref
         # Fallback if link not fetched
         user_dict = {
             "id": str(author_data.id),
@@ -36,6 +48,7 @@ class CommentOut(BaseModel):
             "display_name": getattr(author_data, "display_name", "Người dùng"),
             "avatar_url": getattr(author_data, "avatar_url", None),
             "background_url": getattr(author_data, "background_url", None),
+            "avatar_variants": getattr(author_data, "avatar_variants", None) or {},
             "bio": getattr(author_data, "bio", None)
         }
         author_out = UserOut.model_validate(user_dict)
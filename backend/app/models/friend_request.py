@@ -2,7 +2,9 @@ from typing import Optional
 from beanie import Document, Link, PydanticObjectId
 from pydantic import BaseModel, Field, ConfigDict
 from datetime import datetime
+from pymongo import IndexModel, ASCENDING
 from app.models.user import User, UserOut
+from app.core.loader import DocumentLoader
 
 class FriendRequest(Document):
     from_user: Link[User]
@@ -12,6 +14,10 @@ class FriendRequest(Document):
 
     class Settings:
         name = "friend_requests"
+        indexes = [
+            IndexModel([("to_user.$id", ASCENDING), ("status", ASCENDING)]),
+            IndexModel([("from_user.$id", ASCENDING), ("to_user.$id", ASCENDING), ("status", ASCENDING)]),
+        ]
 
 class FriendRequestOut(BaseModel):
     id: str
@@ -25,9 +31,12 @@ class FriendRequestOut(BaseModel):
     )
 
     @classmethod
-    async def from_doc(cls, doc: FriendRequest) -> "FriendRequestOut":
+    async def from_doc(cls, doc: FriendRequest, users: Optional[DocumentLoader] = None) -> "FriendRequestOut":
+        from_user = users.get(doc.from_user) if users else None
+        if from_user is not None:
+            doc.from_user = from_user
         # Ensure from_user is fetched
-        if isinstance(doc.from_user, Link):
+        elif isinstance(doc.from_user, Link):
             await doc.fetch_link(FriendRequest.from_user)
             
         return cls(
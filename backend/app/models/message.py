@@ -2,7 +2,9 @@ from typing import Optional, List, Any
 from beanie import Document, Link, PydanticObjectId
 from pydantic import BaseModel, Field, ConfigDict
 from datetime import datetime
+from pymongo import IndexModel, ASCENDING, DESCENDING
 from app.models.user import User
+from app.core.loader import DocumentLoader
 
 class Message(Document):
     conversation_id: PydanticObjectId
@@ -16,6 +18,9 @@ class Message(Document):
     
     class Settings:
         name = "messages"
+        indexes = [
+            IndexModel([("conversation_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)]),
+        ]
 
 class MessageOut(BaseModel):
     id: str
@@ -27,8 +32,11 @@ class MessageOut(BaseModel):
     avatarUrl: Optional[str] = ""
 
     @classmethod
-    async def from_doc(cls, doc: Message) -> "MessageOut":
-        if isinstance(doc.sender, Link):
+    async def from_doc(cls, doc: Message, users: Optional[DocumentLoader] = None) -> "MessageOut":
+        sender = users.get(doc.sender) if users else None
+        if sender is not None:
+            doc.sender = sender
+        elif isinstance(doc.sender, Link):
             await doc.fetch_link(Message.sender)
             
         content = {"type": doc.message_type}
@@ -61,6 +69,9 @@ class Conversation(Document):
     
     class Settings:
         name = "conversations"
+        indexes = [
+            IndexModel([("participants.$id", ASCENDING), ("updated_at", DESCENDING)]),
+        ]
 
 class ConversationOut(BaseModel):
     id: str
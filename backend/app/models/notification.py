@@ -2,6 +2,7 @@ from typing import Optional, List, Any, Dict
 from beanie import Document, Indexed, PydanticObjectId, Link
 from pydantic import BaseModel, Field, ConfigDict
 from datetime import datetime
+from pymongo import IndexModel, ASCENDING, DESCENDING
 from app.models.user import User
 
 class Notification(Document):
@@ -13,10 +14,28 @@ class Notification(Document):
     related_id: Optional[str] = None # Post ID, Message ID, etc.
     content: str
     is_read: bool = False
+    # Coalesced notifications (app.services.notifications): most recent actors
+    # first, capped, and the number of distinct actors in the group
+    actor_ids: List[str] = Field(default_factory=list)
+    actor_count: int = 1
+    # Every distinct actor of the group, so repeats are never counted twice
+    actors: List[str] = Field(default_factory=list)
+    # "<recipient>:<type>:<related_id>" while the group is open; unique, so
+    # concurrent events can only ever upsert into one document
+    group_key: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.now)
 
     class Settings:
         name = "notifications"
+        indexes = [
+            IndexModel([("recipient.$id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+            IndexModel([("recipient.$id", ASCENDING), ("is_read", ASCENDING), ("created_at", DESCENDING)]),
+            IndexModel(
+                [("group_key", ASCENDING)],
+                unique=True,
+                partialFilterExpression={"group_key": {"$type": "string"}}
+            ),
+        ]
 
 class NotificationOut(BaseModel):
     id: str = Field(validation_alias="id")
@@ -38,6 +57,8 @@ class NotificationOut(BaseModel):
         metadata = {
             "senderId": doc.sender_id,
             "avatar": doc.sender_avatar,
+            "actorCount": doc.actor_count,
+            "actorIds": doc.actor_ids,
         }
         if doc.related_id:
             if "post" in doc.type or doc.type in ("like", "comment", "share"):
@@ -51,11 +72,15 @@ class NotificationOut(BaseModel):
         else:
             recipient_id = str(doc.recipient.id)
 
+        title = doc.sender_name
+        if doc.actor_count > 1:
+            title = f"{doc.sender_name} và {doc.actor_count - 1} người khác"
+
         return cls(
             id=str(doc.id),
             userId=recipient_id,
             type=doc.type,
-            title=doc.sender_name,
+            title=title,
             message=doc.content,
             metadata=metadata,
             isRead=doc.is_read,
@@ -2,7 +2,13 @@ from typing import Optional, List, Any, Dict
 from beanie import Document, Link, PydanticObjectId
 from pydantic import BaseModel, Field, ConfigDict
 from datetime import datetime
+from pymongo import IndexModel, ASCENDING, DESCENDING
 from app.models.user import User, UserOut
+from app.models.reaction import PostReaction
+from app.core.loader import DocumentLoader
+from app.core.cache import user_cache
+from app.core.links import to_object_id
+from app.core.variants import content_key, variant_urls
 
 class Reaction(BaseModel):
     user_id: str = Field(validation_alias="user_id", serialization_alias="userId")
@@ -18,17 +24,28 @@ class Post(Document):
     image_urls: List[str] = Field(default_factory=list)
     file_urls: List[str] = Field(default_factory=list)
     video_urls: List[str] = Field(default_factory=list)
+    # content hash -> {size: file name} for resized images (app.services.images)
+    media_variants: Dict[str, Dict[str, str]] = Field(default_factory=dict)
     
     shared_post: Optional[Link["Post"]] = None
     
+    # Legacy embedded reactions; moved to post_reactions on first write (app.services.reactions)
     reactions: List[Reaction] = Field(default_factory=list)
+    # Per-type totals maintained with $inc
+    reaction_counts: Dict[str, int] = Field(default_factory=dict)
     comments_count: int = 0
+    # Folded content terms for search (app.services.search)
+    search_terms: List[str] = Field(default_factory=list)
     
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
     
     class Settings:
         name = "posts"
+        indexes = [
+            IndexModel([("author.$id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+            IndexModel([("search_terms", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        ]
 
 # Pydantic Schemas
 class PostCreate(BaseModel):
@@ -40,6 +57,8 @@ class PostOut(BaseModel):
     authorId: str = Field(validation_alias="author_id")
     authorInfo: UserOut = Field(validation_alias="author_info")
     mediaUrls: List[str] = Field(default_factory=list, validation_alias="media_urls")
+    # Aligned with mediaUrls: {"thumb", "small", "medium"} URLs, empty until generated
+    mediaVariants: List[Dict[str, str]] = Field(default_factory=list, validation_alias="media_variants")
     reactions: List[Reaction] = Field(default_factory=list)
     reactionCounts: Dict[str, int] = Field(default_factory=dict, validation_alias="reaction_counts")
     sharedPost: Optional["PostOut"] = Field(default=None, validation_alias="shared_post")
@@ -52,10 +71,17 @@ class PostOut(BaseModel):
     )
 
     @classmethod
-    def from_doc(cls, doc: Post, current_user_id: Optional[str] = None) -> Optional["PostOut"]:
+    def from_doc(
+        cls,
+        doc: Post,
+        current_user_id: Optional[str] = None,
+        users: Optional[DocumentLoader] = None,
+        posts: Optional[DocumentLoader] = None,
+        my_reactions: Optional[Dict[PydanticObjectId, str]] = None
+    ) -> Optional["PostOut"]:
         try:
-            author_data = doc.author
-            if author_data is None:
+            author_data = users.get(doc.author) if users else doc.author
+            if author_data is None or isinstance(author_data, Link):
                 return None
             
             # Create a dict for UserOut to ensure displayName is correct
@@ -66,6 +92,7 @@ class PostOut(BaseModel):
                 "display_name": getattr(author_data, "display_name", "Người dùng"),
                 "avatar_url": getattr(author_data, "avatar_url", None),
                 "background_url": getattr(author_data, "background_url", None),
+                "avatar_variants": getattr(author_data, "avatar_variants", None) or {},
                 "bio": getattr(author_data, "bio", None),
                 "is_public_email": getattr(author_data, "is_public_email", True)
             }
@@ -76,29 +103,43 @@ class PostOut(BaseModel):
             if doc.image_urls: media_urls.extend(doc.image_urls)
             if doc.video_urls: media_urls.extend(doc.video_urls)
             if doc.file_urls: media_urls.extend(doc.file_urls)
+            media_variants = [
+                variant_urls(url, doc.media_variants.get(content_key(url)))
+                for url in media_urls
+            ]
 
-            # Initialize reactionCounts
-            reaction_counts = {}
-            for r in doc.reactions:
-                reaction_counts[r.type] = reaction_counts.get(r.type, 0) + 1
+            # Counters are kept on the post; legacy posts still carry the embedded list
+            if doc.reaction_counts:
+                reaction_counts = {k: v for k, v in doc.reaction_counts.items() if v > 0}
+            else:
+                reaction_counts = {}
+                for r in doc.reactions:
+                    reaction_counts[r.type] = reaction_counts.get(r.type, 0) + 1
 
-            # Check if current user liked
-            is_liked = False
+            # Only the viewer's own reaction is sent back
+            my_reaction = None
             if current_user_id:
-                is_liked = any(r.user_id == current_user_id for r in doc.reactions)
+                if my_reactions is not None and doc.id in my_reactions:
+                    my_reaction = my_reactions[doc.id]
+                else:
+                    my_reaction = next((r.type for r in doc.reactions if r.user_id == current_user_id), None)
+            reactions = [Reaction(user_id=current_user_id, type=my_reaction)] if my_reaction else []
+            is_liked = my_reaction is not None
 
             # Handle shared post
             shared_post_out = None
             if doc.shared_post:
                 shared_doc = None
-                if isinstance(doc.shared_post, Post):
+                if posts:
+                    shared_doc = posts.get(doc.shared_post)
+                elif isinstance(doc.shared_post, Post):
                     shared_doc = doc.shared_post
                 elif hasattr(doc.shared_post, "value") and doc.shared_post.value:
                     shared_doc = doc.shared_post.value
                 
                 if shared_doc:
                     # Recursive call for shared post
-                    shared_post_out = cls.from_doc(shared_doc, current_user_id)
+                    shared_post_out = cls.from_doc(shared_doc, current_user_id, users, posts, my_reactions)
 
             return cls(
                 id=str(doc.id),
@@ -106,7 +147,8 @@ class PostOut(BaseModel):
                 authorId=str(author_data.id),
                 authorInfo=author_out,
                 mediaUrls=media_urls,
-                reactions=doc.reactions,
+                mediaVariants=media_variants,
+                reactions=reactions,
                 reactionCounts=reaction_counts,
                 sharedPost=shared_post_out,
                 createdAt=doc.created_at,
@@ -117,3 +159,42 @@ class PostOut(BaseModel):
             import traceback
             traceback.print_exc()
             return None
+
+async def load_post_links(posts: List[Post]):
+    # Resolve authors and shared posts for a whole page: one query per collection
+    users = DocumentLoader(User, user_cache)
+    shared = DocumentLoader(Post)
+    for p in posts:
+        users.add(p.author)
+        shared.add(p.shared_post)
+    await shared.load()
+    for sp in shared.values():
+        users.add(sp.author)
+    await users.load()
+    return users, shared
+
+async def load_my_reactions(post_ids: List[PydanticObjectId], user_id: Optional[str]) -> Dict[PydanticObjectId, str]:
+    # Viewer's reaction for every post on the page in one query
+    viewer = to_object_id(user_id) if user_id else None
+    if viewer is None or not post_ids:
+        return {}
+    docs = await PostReaction.get_motor_collection().find(
+        {"user_id": viewer, "post_id": {"$in": post_ids}},
+        {"_id": 0, "post_id": 1, "type": 1},
+    ).to_list(length=None)
+    return {doc["post_id"]: doc["type"] for doc in docs}
+
+async def serialize_posts(posts: List[Post], current_user_id: Optional[str] = None) -> List[PostOut]:
+    users, shared = await load_post_links(posts)
+    post_ids = [p.id for p in posts] + [sp.id for sp in shared.values()]
+    my_reactions = await load_my_reactions(post_ids, current_user_id)
+    result = []
+    for p in posts:
+        post_out = PostOut.from_doc(p, current_user_id, users, shared, my_reactions)
+        if post_out:
+            result.append(post_out)
+    return result
+
+async def serialize_post(post: Post, current_user_id: Optional[str] = None) -> Optional[PostOut]:
+    result = await serialize_posts([post], current_user_id)
+    return result[0] if result else None
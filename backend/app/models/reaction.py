@@ -0,0 +1,20 @@
+from beanie import Document, PydanticObjectId
+from pydantic import Field
+from pymongo import IndexModel, ASCENDING
+from datetime import datetime
+
+REACTION_TYPES = ("like", "love", "haha", "wow", "sad", "angry")
+
+class PostReaction(Document):
+    # One row per (post, user); per-type totals live in Post.reaction_counts
+    post_id: PydanticObjectId
+    user_id: PydanticObjectId
+    type: str
+    created_at: datetime = Field(default_factory=datetime.now)
+
+    class Settings:
+        name = "post_reactions"
+        indexes = [
+            IndexModel([("post_id", ASCENDING), ("user_id", ASCENDING)], unique=True),
+            IndexModel([("user_id", ASCENDING), ("post_id", ASCENDING)]),
+        ]
@@ -0,0 +1,39 @@
+from typing import Optional
+from beanie import Document, PydanticObjectId
+from pydantic import Field
+from pymongo import IndexModel, ASCENDING
+from datetime import datetime
+
+class TokenFamily(Document):
+    # One login session: every refresh token rotated from the same login shares
+    # the family. Only the newest refresh token (current_jti) is accepted.
+    user_id: PydanticObjectId
+    current_jti: str
+    previous_jti: Optional[str] = None
+    rotated_at: Optional[datetime] = None
+    revoked: bool = False
+    revoked_at: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    expires_at: datetime
+
+    class Settings:
+        name = "token_families"
+        indexes = [
+            IndexModel([("user_id", ASCENDING)]),
+            IndexModel([("revoked", ASCENDING), ("revoked_at", ASCENDING)]),
+            # Families disappear once their last refresh token has expired
+            IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+        ]
+
+class RetiredRefreshToken(Document):
+    # Refresh tokens from before token families (no fam/jti claim). Each may be
+    # exchanged for a session once; kept until the token itself would expire.
+    token_hash: str # sha256 hex of the raw token
+    expires_at: datetime
+
+    class Settings:
+        name = "retired_refresh_tokens"
+        indexes = [
+            IndexModel([("token_hash", ASCENDING)], unique=True),
+            IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+        ]
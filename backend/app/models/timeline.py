@@ -0,0 +1,20 @@
+from beanie import Document, PydanticObjectId
+from pydantic import Field
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from datetime import datetime
+
+class TimelineEntry(Document):
+    # One row per (feed owner, post). Filled on write by app.services.timeline
+    owner_id: PydanticObjectId
+    post_id: PydanticObjectId
+    author_id: PydanticObjectId
+    created_at: datetime = Field(default_factory=datetime.now)
+
+    class Settings:
+        name = "timelines"
+        indexes = [
+            IndexModel([("owner_id", ASCENDING), ("created_at", DESCENDING), ("post_id", DESCENDING)]),
+            IndexModel([("owner_id", ASCENDING), ("post_id", ASCENDING)], unique=True),
+            IndexModel([("post_id", ASCENDING)]),
+            IndexModel([("owner_id", ASCENDING), ("author_id", ASCENDING)]),
+        ]
@@ -0,0 +1,16 @@
+from typing import Dict
+from beanie import Document, PydanticObjectId
+from pydantic import Field
+
+class UnreadCounter(Document):
+    # One row per user (_id = user id), maintained incrementally by
+    # app.services.unread so badges never need a count() or seen_ids scan
+    id: PydanticObjectId
+    notifications: int = 0
+    conversations: Dict[str, int] = Field(default_factory=dict) # conversation id -> unread messages
+    initialized: bool = False
+    # Bumped by every change; orders unread_counts events between workers
+    version: int = 0
+
+    class Settings:
+        name = "unread_counters"
@@ -1,7 +1,9 @@
-from typing import Optional, List, Any
+from typing import Optional, List, Any, Dict
 from beanie import Document, Indexed, PydanticObjectId
-from pydantic import BaseModel, EmailStr, Field, ConfigDict, field_validator
+from pydantic import BaseModel, EmailStr, Field, ConfigDict, field_validator, model_validator
 from datetime import datetime
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from app.core.variants import variant_urls
 
 class User(Document):
     username: Indexed(str, unique=True)
@@ -11,6 +13,8 @@ class User(Document):
     bio: Optional[str] = None
     avatar_url: Optional[str] = Field(None, alias="avatarUrl")
     background_url: Optional[str] = Field(None, alias="backgroundUrl")
+    # Resized avatar file names (app.services.images), reset when the avatar changes
+    avatar_variants: Dict[str, str] = Field(default_factory=dict)
     is_active: bool = True
     is_public_email: bool = Field(True, alias="isPublicEmail")
     created_at: datetime = Field(default_factory=datetime.now)
@@ -20,9 +24,21 @@ class User(Document):
     
     # Blocked
     blocked_users: List[str] = []
+
+    # Folded name prefixes for search (app.services.search)
+    search_keys: List[str] = Field(default_factory=list)
+
+    # Set once the timeline holds this user's feed (app.services.timeline);
+    # until then /feed also reads friends' posts directly
+    timeline_ready: bool = False
     
     class Settings:
         name = "users"
+        indexes = [
+            IndexModel([("search_keys", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+            # Deactivated accounts only (app.core.revocation reloads them periodically)
+            IndexModel([("is_active", ASCENDING)], partialFilterExpression={"is_active": False}),
+        ]
 
 class UserCreate(BaseModel):
     username: str
@@ -42,6 +58,7 @@ class UserOut(BaseModel):
     displayName: str = Field(validation_alias="display_name", serialization_alias="displayName")
     bio: Optional[str] = None
     avatarUrl: Optional[str] = Field(None, validation_alias="avatar_url", serialization_alias="avatarUrl")
+    avatarVariants: Dict[str, str] = Field(default_factory=dict, validation_alias="avatar_variants", serialization_alias="avatarVariants")
     backgroundUrl: Optional[str] = Field(None, validation_alias="background_url", serialization_alias="backgroundUrl")
     isPublicEmail: bool = Field(True, validation_alias="is_public_email", serialization_alias="isPublicEmail")
     
@@ -55,6 +72,11 @@ class UserOut(BaseModel):
     def convert_id(cls, v: Any) -> str:
         return str(v)
 
+    @model_validator(mode="after")
+    def resolve_avatar_variants(self) -> "UserOut":
+        self.avatarVariants = variant_urls(self.avatarUrl, self.avatarVariants)
+        return self
+
 class Token(BaseModel):
     access_token: str
     refresh_token: str
@@ -3,27 +3,15 @@ from typing import Any
 from pydantic import BaseModel, EmailStr
 from app.models.user import User, UserCreate, UserLogin, Token, UserOut
 from app.core import security
-from app.core.deps import get_current_user
-from fastapi_mail import ConnectionConfig, FastMail, MessageSchema, MessageType
+from app.core.deps import AuthContext, get_auth
+from app.core.cache import user_cache
+from app.core.jobs import jobs
+from app.services import mail, search, sessions
 import random
 import string
 
 router = APIRouter()
 
-# Mail configuration
-conf = ConnectionConfig(
-    MAIL_USERNAME=security.settings.MAIL_USERNAME,
-    MAIL_PASSWORD=security.settings.MAIL_PASSWORD,
-    MAIL_FROM=security.settings.MAIL_FROM,
-    MAIL_PORT=security.settings.MAIL_PORT,
-    MAIL_SERVER=security.settings.MAIL_SERVER,
-    MAIL_FROM_NAME=security.settings.MAIL_FROM_NAME,
-    MAIL_STARTTLS=True,
-    MAIL_SSL_TLS=False,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True
-)
-
 # Models for OTP moved to body dict for flexibility
 
 @router.post("/send-otp")
@@ -49,20 +37,9 @@ async def send_otp(data: dict = Body(...)):
     otp = ''.join(random.choices(string.digits, k=6))
     print(f"DEBUG: Generated OTP {otp} for {email_to_send}")
     
-    if security.settings.MAIL_USERNAME and security.settings.MAIL_PASSWORD:
-        message = MessageSchema(
-            subject="Mã xác thực OTP - Relo Social",
-            recipients=[email_to_send],
-            body=f"Mã OTP của bạn là: {otp}. Vui lòng không cung cấp mã này cho bất kỳ ai.",
-            subtype=MessageType.plain
-        )
-        fm = FastMail(conf)
-        try:
-            await fm.send_message(message)
-            print(f"DEBUG: Real Email sent to {email_to_send}")
-        except Exception as e:
-            print(f"DEBUG: Failed to send real email: {e}")
-            return {"message": f"OTP sent failed (Check console)", "email": email_to_send}
+    if mail.mail_enabled():
+        # Delivered by a job worker; the response doesn't wait on SMTP
+        await jobs.enqueue("send_otp_email", email=email_to_send, otp=otp)
 
     return {"message": "OTP sent successfully", "email": email_to_send}
 
@@ -92,8 +69,9 @@ async def reset_password(data: dict = Body(...)):
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
         
-    user.password_hash = security.get_password_hash(new_password)
-    await user.save()
+    await user.set({User.password_hash: await security.hash_password_async(new_password)})
+    user_cache.invalidate(user.id)
+    await sessions.revoke_all(user.id)
     return {"message": "Password reset successfully"}
 
 @router.post("/change-email/verify-password")
@@ -101,7 +79,7 @@ async def verify_password_for_email_change(data: dict = Body(...)):
     user_id = data.get("user_id")
     password = data.get("password")
     user = await User.get(user_id)
-    if not user or not security.verify_password(password, user.password_hash):
+    if not user or not await security.verify_password_async(password, user.password_hash):
         raise HTTPException(status_code=400, detail="Mật khẩu không chính xác")
     return {"status": "ok"}
 
@@ -112,8 +90,8 @@ async def update_email(data: dict = Body(...)):
     user = await User.get(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    user.email = new_email
-    await user.save()
+    await user.set({User.email: new_email})
+    user_cache.invalidate(user.id)
     return {"message": "Email updated successfully"}
 
 @router.post("/register", response_model=UserOut)
@@ -134,8 +112,11 @@ async def register(user_in: UserCreate) -> Any:
     user = User(
         username=user_in.username,
         email=user_in.email,
-        password_hash=security.get_password_hash(user_in.password),
-        display_name=user_in.displayName
+        password_hash=await security.hash_password_async(user_in.password),
+        display_name=user_in.displayName,
+        search_keys=search.user_search_keys(user_in.username, user_in.displayName),
+        # Nothing to materialize yet: fan-out fills the timeline from here on
+        timeline_ready=True
     )
     await user.create()
     return user
@@ -143,57 +124,36 @@ async def register(user_in: UserCreate) -> Any:
 @router.post("/login", response_model=Token)
 async def login(user_in: UserLogin) -> Any:
     user = await User.find_one(User.username == user_in.username)
-    if not user or not security.verify_password(user_in.password, user.password_hash):
+    valid, new_hash = await security.verify_and_update_async(user_in.password, user.password_hash) if user else (False, None)
+    if not valid:
         raise HTTPException(
             status_code=401,
             detail="Tên đăng nhập hoặc mật khẩu không chính xác.",
         )
+    if new_hash:
+        # Stored with outdated bcrypt parameters: upgrade transparently
+        await user.set({User.password_hash: new_hash})
+        user_cache.invalidate(user.id)
+        security.hash_metrics.rehashed += 1
         
     if not user.is_active:
         raise HTTPException(status_code=400, detail="Tài khoản đã bị khóa.")
         
-    access_token = security.create_access_token(user.id)
-    refresh_token = security.create_refresh_token(user.id)
-    
-    return {
-        "access_token": access_token,
-        "refresh_token": refresh_token,
-        "token_type": "bearer",
-    }
+    return await sessions.start_session(user.id)
 
 @router.post("/refresh", response_model=Token)
 async def refresh_token(refresh_token: str = Body(..., embed=True)) -> Any:
-    try:
-        payload = security.jwt.decode(refresh_token, security.settings.SECRET_KEY, algorithms=[security.settings.ALGORITHM])
-        if payload.get("type") != "refresh":
-             raise HTTPException(status_code=401, detail="Invalid token type")
-        user_id = payload.get("sub")
-        if user_id is None:
-             raise HTTPException(status_code=401, detail="Invalid token")
-    except security.JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
-        
-    user = await User.get(user_id)
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
-        
-    access_token = security.create_access_token(user.id)
-    # Rotate refresh token? For simplicity, we can keep using same or issue new one.
-    # Let's issue new one
-    new_refresh_token = security.create_refresh_token(user.id)
-    
-    return {
-        "access_token": access_token,
-        "refresh_token": new_refresh_token,
-        "token_type": "bearer",
-    }
+    # Rotates the refresh token; reusing an old one revokes the whole session
+    return await sessions.rotate(refresh_token)
     
 @router.post("/logout")
 async def logout(
-    current_user: User = Depends(get_current_user),
+    auth: AuthContext = Depends(get_auth),
     device_token: str = Body(None, embed=True)
 ) -> Any:
-    # In a real app with stateful sessions or redis whitelist/blacklist, handle logout here.
-    # For stateless JWT, client just discards token.
-    # We might remove device token from user if we stored it for notifications.
+    # Ends this device's session: its refresh token stops working and its
+    # access tokens are rejected from the in-memory revocation set
+    family_id = auth.claims.get("fam")
+    if family_id:
+        await sessions.revoke(family_id)
     return {"message": "Logged out"}
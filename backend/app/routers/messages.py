@@ -1,59 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, Body, Form, UploadFile, File
+import json
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, Body, Form, UploadFile, File, Response, Request
 from typing import List, Optional, Any
 from app.models.message import Message, Conversation, ConversationCreate, MessageOut, ConversationOut
 from app.models.user import User
-from app.core.deps import get_current_user
+from app.core.deps import AuthContext, get_auth, get_current_user, decode_token
+from app.core.pagination import keyset_filter, set_next_cursor
+from app.core.links import link_eq, link_all
+from app.core.loader import DocumentLoader
+from app.core.cache import user_cache
 from beanie import PydanticObjectId
-from jose import jwt, JWTError
-from app.core.config import settings
+from app.core.realtime import manager, encode_frame, CLOSE_REVOKED
+from app.services import chat, media, unread
 
 router = APIRouter()
 
-# WebSocket Manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        self.user_connections: dict = {} # user_id -> WebSocket
-
-    async def connect(self, websocket: WebSocket, user_id: str):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        self.user_connections[user_id] = websocket
-
-    def disconnect(self, websocket: WebSocket, user_id: str):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-        if user_id in self.user_connections:
-            del self.user_connections[user_id]
-
-    async def send_personal_message(self, message: str, user_id: str):
-        if user_id in self.user_connections:
-            try:
-                await self.user_connections[user_id].send_text(message)
-            except:
-                pass
-
-manager = ConnectionManager()
-
 @router.get("/conversations")
 async def get_conversations(current_user: User = Depends(get_current_user)):
-    # Beanie participants is a list of Links. We need to find where any link points to our user.
-    # We query by the DB ref structure or fetch and filter. 
-    # Let's use a more robust query for Beanie Links:
+    # participants is a list of Links (DBRefs); match on the referenced id.
+    # Served by the (participants.$id, updated_at) index, empty results included.
     conversations = await Conversation.find(
-        {"participants.$id": current_user.id},
+        link_eq("participants", current_user.id),
         fetch_links=True
     ).sort(-Conversation.updated_at).to_list()
-    
-    # If Beanie's $id query is acting up with Links, fallback:
-    if not conversations:
-        all_convs = await Conversation.find_all(fetch_links=True).to_list()
-        conversations = [
-            c for c in all_convs 
-            if any(str(p.id) == str(current_user.id) for p in c.participants)
-        ]
-        # Sort by updated_at desc
-        conversations.sort(key=lambda x: x.updated_at, reverse=True)
 
     result = []
     for conv in conversations:
@@ -61,6 +29,12 @@ async def get_conversations(current_user: User = Depends(get_current_user)):
         result.append(out.model_dump(by_alias=True))
     return result
 
+@router.get("/conversations/unread-counts")
+async def get_unread_counts(auth: AuthContext = Depends(get_auth)):
+    # Cached per-conversation counters (also pushed as "unread_counts" events)
+    counts = await unread.get_counts(auth.user_id)
+    return {"conversations": counts["conversations"], "total": counts["conversationsTotal"]}
+
 @router.get("/conversations/{conversation_id}")
 async def get_conversation_by_id(conversation_id: str, current_user: User = Depends(get_current_user)):
     conv = await Conversation.get(conversation_id, fetch_links=True)
@@ -74,11 +48,8 @@ async def create_conversation(
     conv_in: ConversationCreate,
     current_user: User = Depends(get_current_user)
 ):
-    participants = []
-    for pid in conv_in.participant_ids:
-        user = await User.get(pid)
-        if user:
-            participants.append(user)
+    found = await user_cache.get_many(conv_in.participant_ids)
+    participants = list(found.values())
     
     if str(current_user.id) not in [str(p.id) for p in participants]:
         participants.append(current_user)
@@ -87,7 +58,7 @@ async def create_conversation(
     if not conv_in.is_group and len(participants) == 2:
         p_ids = [str(p.id) for p in participants]
         existing = await Conversation.find(
-            {"is_group": False, "participants.$id": {"$all": [PydanticObjectId(i) for i in p_ids]}}
+            {"is_group": False, **link_all("participants", p_ids)}
         ).first_or_none()
         if existing:
             out = await ConversationOut.from_doc(existing)
@@ -105,76 +76,47 @@ async def create_conversation(
 @router.get("/conversations/{conversation_id}/messages")
 async def get_messages(
     conversation_id: str,
+    response: Response,
     offset: int = 0,
     limit: int = 50,
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
+    query = {"conversation_id": PydanticObjectId(conversation_id)}
+    query.update(keyset_filter("timestamp", cursor))
     messages = await Message.find(
-        Message.conversation_id == PydanticObjectId(conversation_id),
-        fetch_links=True
-    ).sort(-Message.timestamp).skip(offset).limit(limit).to_list()
+        query
+    ).sort([("timestamp", -1), ("_id", -1)]).skip(0 if cursor else offset).limit(limit).to_list()
+    set_next_cursor(response, messages, limit, lambda m: (m.timestamp, m.id))
+
+    users = DocumentLoader(User, user_cache)
+    users.add_many(m.sender for m in messages)
+    await users.load()
     
     result = []
     for msg in messages:
-        out = await MessageOut.from_doc(msg)
+        out = await MessageOut.from_doc(msg, users)
         result.append(out.model_dump(by_alias=True))
     return result
 
 @router.post("/conversations/{conversation_id}/messages")
 async def send_message(
     conversation_id: str,
+    request: Request,
     type: str = Form(...),
     text: Optional[str] = Form(None),
     files: List[UploadFile] = File(None),
     current_user: User = Depends(get_current_user)
 ):
-    conv = await Conversation.get(conversation_id, fetch_links=True)
-    if not conv:
+    # Before ingesting: attachments for a conversation the sender can't post
+    # to would only be left behind in the media store
+    if not await chat.is_participant(conversation_id, current_user.id):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    file_urls = await media.save_uploads(request, files)
+
+    msg_data = await chat.post_message(conversation_id, current_user, type, text, file_urls)
+    if msg_data is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
-        
-    file_urls = []
-    if files:
-        for f in files:
-            file_urls.append(f"http://10.0.2.2:5173/static/{f.filename}")
-            
-    message = Message(
-        conversation_id=PydanticObjectId(conversation_id),
-        sender=current_user,
-        message_type=type,
-        text=text,
-        file_urls=file_urls
-    )
-    await message.create()
-    
-    # Update last message
-    conv.last_message = {
-        "content_type": type,
-        "text": text,
-        "sender_id": str(current_user.id),
-        "timestamp": message.timestamp.isoformat()
-    }
-    conv.updated_at = message.timestamp
-    conv.seen_ids = [str(current_user.id)]
-    await conv.save()
-    
-    # Notify via WS
-    msg_out = await MessageOut.from_doc(message)
-    msg_data = msg_out.model_dump(by_alias=True)
-    import json
-    ws_msg = json.dumps({
-        "type": "new_message", 
-        "payload": {
-            "message": msg_data,
-            "conversation": {
-                "participantCount": len(conv.participants)
-            }
-        }
-    })
-    
-    for p in conv.participants:
-        if str(p.id) != str(current_user.id):
-            await manager.send_personal_message(ws_msg, str(p.id))
-            
     return msg_data
 
 @router.post("/conversations/{conversation_id}/seen")
@@ -182,15 +124,9 @@ async def mark_as_seen(
     conversation_id: str,
     current_user: User = Depends(get_current_user)
 ):
-    conv = await Conversation.get(conversation_id)
-    if not conv:
+    if not await chat.mark_seen(conversation_id, current_user):
         raise HTTPException(status_code=404, detail="Conversation not found")
         
-    user_id_str = str(current_user.id)
-    if user_id_str not in conv.seen_ids:
-        conv.seen_ids.append(user_id_str)
-        await conv.save()
-        
     return {"status": "success"}
 
 @router.websocket("/ws")
@@ -198,19 +134,83 @@ async def websocket_endpoint(websocket: WebSocket, token: str = None):
     if not token:
         await websocket.close(code=1008)
         return
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            await websocket.close(code=1008)
-            return
-    except:
+    payload = decode_token(token)
+    if payload is None:
         await websocket.close(code=1008)
         return
+    user_id: str = payload["sub"]
 
-    await manager.connect(websocket, user_id)
+    conn = await manager.connect(websocket, user_id, payload.get("fam"))
+    if conn is None:
+        return
     try:
         while True:
-            await websocket.receive_text()
+            raw = await websocket.receive_text()
+            # Any inbound frame (including {"type": "pong"}) counts as liveness
+            manager.mark_seen(websocket)
+            await _handle_frame(conn, user_id, raw)
     except WebSocketDisconnect:
+        pass
+    finally:
+        # Removes this socket only; the user's other devices stay connected
         manager.disconnect(websocket, user_id)
+
+# Client -> server frames: {"type": ..., "id": <client ref>, "payload": {...}}.
+# The socket is authenticated once at connect, so a chat message costs no JWT
+# decode, user lookup or multipart parsing. Replies go through the connection's
+# own queue, like every other event.
+async def _handle_frame(conn, user_id: str, raw: str):
+    try:
+        frame = json.loads(raw)
+    except ValueError:
+        conn.enqueue(encode_frame("error", {"ref": None, "detail": "Invalid JSON"}))
+        return
+    if not isinstance(frame, dict):
+        return
+
+    if conn.is_revoked():
+        # Logged out after this socket authenticated
+        conn.evict(CLOSE_REVOKED)
+        return
+
+    frame_type = frame.get("type")
+    ref = frame.get("id")
+    payload = frame.get("payload") or {}
+    if frame_type == "pong" or not isinstance(payload, dict):
+        return
+
+    conversation_id = payload.get("conversationId")
+    try:
+        if frame_type == "send_message":
+            sender = await user_cache.get(user_id)
+            if sender is None:
+                raise ValueError("User not found")
+            msg_data = await chat.post_message(
+                conversation_id,
+                sender,
+                payload.get("type") or "text",
+                payload.get("text")
+            )
+            if msg_data is None:
+                raise ValueError("Conversation not found")
+            # Server-assigned id so the client can swap its optimistic bubble
+            conn.enqueue(encode_frame("ack", {
+                "ref": ref,
+                "messageId": msg_data.get("id"),
+                "message": msg_data
+            }))
+        elif frame_type == "typing":
+            await chat.send_typing(conversation_id, user_id, bool(payload.get("isTyping", True)))
+        elif frame_type == "seen":
+            user = await user_cache.get(user_id)
+            if user is None or not await chat.mark_seen(conversation_id, user):
+                raise ValueError("Conversation not found")
+            if ref is not None:
+                conn.enqueue(encode_frame("ack", {"ref": ref, "conversationId": conversation_id}))
+        else:
+            raise ValueError(f"Unknown frame type: {frame_type}")
+    except ValueError as e:
+        conn.enqueue(encode_frame("error", {"ref": ref, "detail": str(e)}))
+    except Exception as e:
+        print(f"WebSocket frame error: {e}")
+        conn.enqueue(encode_frame("error", {"ref": ref, "detail": "Internal error"}))
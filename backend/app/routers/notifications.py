@@ -1,50 +1,68 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from typing import List, Optional
 from app.models.notification import Notification, NotificationOut
-from app.models.user import User
-from app.core.deps import get_current_user
+from app.core.deps import AuthContext, get_auth
+from app.core.pagination import keyset_filter, set_next_cursor
+from app.core.links import link_eq, to_object_id
+from app.services import unread
 
 router = APIRouter()
 
 @router.get("/", response_model=List[NotificationOut])
 async def get_notifications(
+    response: Response,
     limit: int = 50,
     skip: int = 0,
     unread_only: bool = False,
-    current_user: User = Depends(get_current_user)
+    cursor: Optional[str] = None,
+    auth: AuthContext = Depends(get_auth)
 ):
-    criteria = [Notification.recipient.id == current_user.id]
+    criteria = [Notification.recipient.id == auth.user_id]
     if unread_only:
         criteria.append(Notification.is_read == False)
+    if cursor:
+        criteria.append(keyset_filter("created_at", cursor))
         
-    notifications = await Notification.find(*criteria, fetch_links=True).sort(-Notification.created_at).skip(skip).limit(limit).to_list()
+    notifications = await Notification.find(*criteria, fetch_links=True).sort(
+        [("created_at", -1), ("_id", -1)]
+    ).skip(0 if cursor else skip).limit(limit).to_list()
+    set_next_cursor(response, notifications, limit, lambda n: (n.created_at, n.id))
     return [NotificationOut.from_doc(n) for n in notifications]
 
 @router.get("/unread-count")
-async def get_unread_count(current_user: User = Depends(get_current_user)):
-    count = await Notification.find(Notification.recipient.id == current_user.id, Notification.is_read == False).count()
-    return {"count": count}
+async def get_unread_count(auth: AuthContext = Depends(get_auth)):
+    # Served from cached token claims and the in-memory counts (kept current by
+    # unread_counts events): no DB read per poll once warm
+    counts = await unread.get_counts(auth.user_id)
+    return {"count": counts["notifications"]}
 
 @router.put("/{notification_id}/read")
-async def mark_as_read(notification_id: str, current_user: User = Depends(get_current_user)):
-    notification = await Notification.get(notification_id)
-    if not notification or notification.recipient.ref.id != current_user.id:
+async def mark_as_read(notification_id: str, auth: AuthContext = Depends(get_auth)):
+    oid = to_object_id(notification_id)
+    # Single targeted $set; the recipient filter replaces the ownership pre-read
+    owned = {"_id": oid, **link_eq("recipient", auth.user_id)}
+    result = await Notification.find_one(
+        {**owned, "is_read": False}
+    ).update({"$set": {"is_read": True}, "$unset": {"group_key": ""}}) if oid else None
+    if result and result.modified_count:
+        await unread.add_notifications(auth.user_id, -1)
+    elif not oid or not await Notification.find_one(owned):
         raise HTTPException(status_code=404, detail="Notification not found")
-    
-    notification.is_read = True
-    await notification.save()
     return {"message": "Marked as read"}
 
 @router.put("/read-all")
-async def mark_all_as_read(current_user: User = Depends(get_current_user)):
-    await Notification.find(Notification.recipient.id == current_user.id, Notification.is_read == False).update({"$set": {"is_read": True}})
+async def mark_all_as_read(auth: AuthContext = Depends(get_auth)):
+    await Notification.find(Notification.recipient.id == auth.user_id, Notification.is_read == False).update({"$set": {"is_read": True}, "$unset": {"group_key": ""}})
+    await unread.reset_notifications(auth.user_id)
     return {"message": "All marked as read"}
 
 @router.delete("/{notification_id}")
-async def delete_notification(notification_id: str, current_user: User = Depends(get_current_user)):
+async def delete_notification(notification_id: str, auth: AuthContext = Depends(get_auth)):
     notification = await Notification.get(notification_id)
-    if not notification or notification.recipient.ref.id != current_user.id:
+    if not notification or notification.recipient.ref.id != auth.user_id:
         raise HTTPException(status_code=404, detail="Notification not found")
     
     await notification.delete()
+    if not notification.is_read:
+        await unread.add_notifications(auth.user_id, -1)
     return {"message": "Notification deleted"}
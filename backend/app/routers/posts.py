@@ -1,14 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, Body, UploadFile, File, Form, Request
+from fastapi import APIRouter, Depends, HTTPException, Body, UploadFile, File, Form, Request, Response
 from pydantic import BaseModel, Field
 from typing import List, Optional
-from app.models.post import Post, PostOut, Reaction
+from app.models.post import Post, PostOut, serialize_post, serialize_posts
+from app.models.reaction import REACTION_TYPES
 from app.models.user import User
+from app.core.loader import DocumentLoader
+from app.core.cache import user_cache
 from app.models.comment import Comment, CommentOut
-from app.models.notification import Notification
-from app.core.deps import get_current_user
-from beanie import PydanticObjectId
-from app.routers.messages import manager
-import json
+from app.core.deps import AuthContext, get_auth, get_current_user
+from app.core.pagination import keyset_filter, set_next_cursor
+from app.core.config import settings
+from app.core.links import link_eq, link_id, to_object_id
+from beanie import PydanticObjectId, UpdateResponse
+from app.services import timeline, reactions, media, images, notifications, search
+from datetime import datetime
 
 router = APIRouter()
 
@@ -21,62 +26,79 @@ class ReactRequest(BaseModel):
 @router.get("/user/{user_id}", response_model=List[PostOut])
 async def get_user_posts(
     user_id: str,
+    response: Response,
     skip: int = 0,
     limit: int = 20,
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
-    # Beanie $id query can be flaky with Links
+    if to_object_id(user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    query = link_eq("author", user_id)
+    query.update(keyset_filter("created_at", cursor))
+    # Served by the (author.$id, created_at, _id) index, empty results included
     posts = await Post.find(
-        {"author.$id": PydanticObjectId(user_id)},
-        fetch_links=True
-    ).sort(-Post.created_at).skip(skip).limit(limit).to_list()
-    
-    if not posts:
-        # Fallback manual filter
-        all_posts = await Post.find_all(fetch_links=True).sort(-Post.created_at).to_list()
-        posts = [p for p in all_posts if str(p.author.id) == user_id]
-        # Apply skip/limit
-        posts = posts[skip : skip + limit]
-    
-    feed = []
-    for p in posts:
-        # Fetch shared post author details if needed
-        if p.shared_post:
-            shared_doc = p.shared_post
-            if isinstance(shared_doc, Post):
-                await shared_doc.fetch_link("author")
+        query
+    ).sort([("created_at", -1), ("_id", -1)]).skip(0 if cursor else skip).limit(limit).to_list()
 
-        post_out = PostOut.from_doc(p, str(current_user.id))
-        if post_out:
-            feed.append(post_out)
-    return feed
+    set_next_cursor(response, posts, limit, lambda p: (p.created_at, p.id))
+    return await serialize_posts(posts, str(current_user.id))
 
 @router.get("/feed", response_model=List[PostOut])
 async def get_feed(
+    response: Response,
     skip: int = 0,
     limit: int = 20,
+    cursor: Optional[str] = None,
+    auth: AuthContext = Depends(get_auth)
+):
+    # Only the friend list is needed; the User comes from user_cache
+    current_user = await auth.user()
+    # Friend-scoped page of post ids from the precomputed timeline
+    page = await timeline.read_timeline(current_user, skip, limit, cursor)
+    if not page:
+        return []
+    set_next_cursor(response, page, timeline.clamp_limit(limit), lambda entry: (entry[1], entry[0]))
+    post_ids = [post_id for post_id, _ in page]
+
+    found = await Post.find({"_id": {"$in": post_ids}}).to_list()
+    posts_by_id = {p.id: p for p in found}
+    posts = [posts_by_id[pid] for pid in post_ids if pid in posts_by_id]
+    return await serialize_posts(posts, str(current_user.id))
+
+
+
+@router.get("/search", response_model=List[PostOut])
+async def search_posts(
+    q: str,
+    response: Response,
+    limit: int = 20,
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
-    # For now, just return all posts sorted by date.
-    # In real app, filter by friends.
-    posts = await Post.find_all(fetch_links=True).sort(-Post.created_at).skip(skip).limit(limit).to_list()
-    
-    feed = []
-    for p in posts:
-        # If this is a shared post, we need to fetch the author of the shared post explicitly
-        if p.shared_post:
-            # Ensure we have the document (it should be since fetch_links=True)
-            shared_doc = p.shared_post
-            if isinstance(shared_doc, Post):
-                await shared_doc.fetch_link("author")
-        
-        post_out = PostOut.from_doc(p, str(current_user.id))
-        if post_out:
-            feed.append(post_out)
-            
-    return feed
+    # Word search over posts from the viewer and their friends, newest first
+    limit = max(1, min(limit, settings.SEARCH_MAX_LIMIT))
+    posts = await search.search_posts(current_user, q, limit, cursor)
+    set_next_cursor(response, posts, limit, lambda p: (p.created_at, p.id))
+    return await serialize_posts(posts, str(current_user.id))
 
+@router.get("/search/comments", response_model=List[CommentOut])
+async def search_comments(
+    q: str,
+    response: Response,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    limit = max(1, min(limit, settings.SEARCH_MAX_LIMIT))
+    comments = await search.search_comments(current_user, q, limit, cursor)
+    set_next_cursor(response, comments, limit, lambda c: (c.created_at, c.id))
 
+    users = DocumentLoader(User, user_cache)
+    users.add_many(c.author for c in comments)
+    await users.load()
+    return [CommentOut.from_doc(c, users) for c in comments]
 
 @router.post("", response_model=PostOut)
 async def create_post(
@@ -85,38 +107,17 @@ async def create_post(
     files: List[UploadFile] = File(None),
     current_user: User = Depends(get_current_user)
 ):
-    import os
-    
-    # Ensure static directory exists
-    static_dir = "static"
-    if not os.path.exists(static_dir):
-        os.makedirs(static_dir)
-
-    image_paths = []
-    if files:
-        for file in files:
-            if not file.filename:
-                continue
-            
-            # Use a safer filename
-            filename = file.filename.replace(" ", "_")
-            file_path = os.path.join(static_dir, filename)
-            
-            # Read and write content
-            content_bytes = await file.read()
-            with open(file_path, "wb") as buffer:
-                buffer.write(content_bytes)
-            
-            # Generate absolute URL based on the request host
-            base_url = str(request.base_url).rstrip("/")
-            image_paths.append(f"{base_url}/static/{filename}")
+    image_paths = await media.save_uploads(request, files)
             
     post = Post(
         content=content,
         author=current_user,
-        image_urls=image_paths
+        image_urls=image_paths,
+        search_terms=search.content_terms(content)
     )
     await post.create()
+    images.schedule_post_variants(post)
+    await timeline.fan_out_post(post, current_user)
     
     return PostOut.from_doc(post, str(current_user.id))
 
@@ -143,32 +144,20 @@ async def update_post(
     if post.author.id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to edit this post")
         
-    post.content = content
-    
     # Start with existing URLs if provided
     image_paths = existing_image_urls if existing_image_urls else []
     
-    if files:
-        import os
-        static_dir = "static"
-        if not os.path.exists(static_dir):
-            os.makedirs(static_dir)
-            
-        for file in files:
-            if not file.filename: continue
-            filename = file.filename.replace(" ", "_")
-            file_path = os.path.join(static_dir, filename)
-            content_bytes = await file.read()
-            with open(file_path, "wb") as buffer:
-                buffer.write(content_bytes)
-            
-            base_url = str(request.base_url).rstrip("/")
-            image_paths.append(f"{base_url}/static/{filename}")
+    image_paths += await media.save_uploads(request, files)
     
-    post.image_urls = image_paths
-            
-    await post.save()
-    return PostOut.from_doc(post, str(current_user.id))
+    # $set only the edited fields so concurrent reaction/comment counters survive
+    await post.set({
+        Post.content: content,
+        Post.search_terms: search.content_terms(content),
+        Post.image_urls: image_paths,
+        Post.updated_at: datetime.now()
+    })
+    images.schedule_post_variants(post)
+    return await serialize_post(post, str(current_user.id))
 
 @router.post("/{post_id}/share", response_model=PostOut)
 async def share_post(
@@ -183,60 +172,29 @@ async def share_post(
     new_post = Post(
         content=share_req.content if share_req.content else "",
         author=current_user,
-        shared_post=original_post
+        shared_post=original_post,
+        search_terms=search.content_terms(share_req.content or "")
     )
     await new_post.create()
+    await timeline.fan_out_post(new_post, current_user)
     
     # Notify original author
-    if str(original_post.author.id) != str(current_user.id):
-        notif = Notification(
-            recipient=original_post.author,
-            sender_id=str(current_user.id),
-            sender_name=current_user.display_name,
-            sender_avatar=current_user.avatar_url,
-            type="post_share",
-            related_id=str(new_post.id),
-            content=f"đã chia sẻ bài viết của bạn"
-        )
-        await notif.create()
-        # WS notify
-        ws_msg = json.dumps({
-            "type": "post_share",
-            "payload": {
-                "type": "post_share",
-                "userId": str(current_user.id),
-                "userDisplayName": current_user.display_name,
-                "avatar": current_user.avatar_url,
-                "postId": str(new_post.id)
-            }
-        })
-        await manager.send_personal_message(ws_msg, str(original_post.author.id))
+    await notifications.notify(
+        str(original_post.author.id), current_user, "post_share", str(new_post.id),
+        "đã chia sẻ bài viết của bạn"
+    )
     
-    new_post_fetched = await Post.get(str(new_post.id), fetch_links=True)
-    if new_post_fetched and new_post_fetched.shared_post:
-        # Fetch author of the shared post explicitly
-        shared_doc = new_post_fetched.shared_post
-        if isinstance(shared_doc, Post):
-            await shared_doc.fetch_link("author")
-
-    return PostOut.from_doc(new_post_fetched, str(current_user.id))
+    return await serialize_post(new_post, str(current_user.id))
 
 @router.get("/{post_id}", response_model=PostOut)
 async def get_post(
     post_id: str,
     current_user: User = Depends(get_current_user)
 ):
-    post = await Post.get(post_id, fetch_links=True)
+    post = await Post.get(post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
-    
-    # Fetch shared post author details if needed
-    if post.shared_post:
-        shared_doc = post.shared_post
-        if isinstance(shared_doc, Post):
-            await shared_doc.fetch_link("author")
-            
-    return PostOut.from_doc(post, str(current_user.id))
+    return await serialize_post(post, str(current_user.id))
 
 @router.post("/{post_id}/react")
 async def react_to_post(
@@ -244,46 +202,34 @@ async def react_to_post(
     react_req: ReactRequest = Body(...),
     current_user: User = Depends(get_current_user)
 ):
-    post = await Post.get(post_id, fetch_links=True)
+    if react_req.reaction_type not in REACTION_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid reaction type")
+
+    post = await Post.get(post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
     
     user_id_str = str(current_user.id)
-    # Remove existing reaction from this user if any
-    post.reactions = [r for r in post.reactions if r.user_id != user_id_str]
-    
-    # Add new reaction
-    post.reactions.append(Reaction(user_id=user_id_str, type=react_req.reaction_type))
-    await post.save()
-    
-    # Refresh to get author info for PostOut
-    post = await Post.get(post_id, fetch_links=True)
+    await reactions.set_reaction(post, current_user.id, react_req.reaction_type)
     
     # Notify author
-    if str(post.author.id) != user_id_str:
-        notif = Notification(
-            recipient=post.author,
-            sender_id=user_id_str,
-            sender_name=current_user.display_name,
-            sender_avatar=current_user.avatar_url,
-            type="post_reaction",
-            related_id=post_id,
-            content=f"đã bày tỏ cảm xúc về bài viết của bạn"
-        )
-        await notif.create()
-        ws_msg = json.dumps({
-            "type": "post_reaction", 
-            "payload": {
-                "type": "post_reaction",
-                "userId": user_id_str, # Sender
-                "userDisplayName": current_user.display_name,
-                "avatar": current_user.avatar_url,
-                "postId": post_id
-            }
-        })
-        await manager.send_personal_message(ws_msg, str(post.author.id))
+    await notifications.notify(
+        str(link_id(post.author)), current_user, "post_reaction", post_id,
+        "đã bày tỏ cảm xúc về bài viết của bạn"
+    )
         
-    return PostOut.from_doc(post, user_id_str)
+    return await serialize_post(post, user_id_str)
+
+@router.delete("/{post_id}/react")
+async def remove_post_reaction(
+    post_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    post = await Post.get(post_id)
+    if not post:
+        raise HTTPException(status_code=404, detail="Post not found")
+    await reactions.remove_reaction(post, current_user.id)
+    return await serialize_post(post, str(current_user.id))
 
 @router.post("/{post_id}/comments", response_model=CommentOut)
 async def create_comment(
@@ -291,72 +237,73 @@ async def create_comment(
     content: str = Body(..., embed=True),
     current_user: User = Depends(get_current_user)
 ):
-    post = await Post.get(post_id, fetch_links=True)
+    post_oid = to_object_id(post_id)
+    # Atomic $inc doubles as the existence check; no full read/rewrite of the post
+    post = await Post.find_one({"_id": post_oid}).update(
+        {"$inc": {"comments_count": 1}},
+        response_type=UpdateResponse.NEW_DOCUMENT
+    ) if post_oid else None
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
     
     comment = Comment(
-        post_id=PydanticObjectId(post_id),
+        post_id=post_oid,
         author=current_user,
-        content=content
+        content=content,
+        search_terms=search.content_terms(content),
+        post_author_id=link_id(post.author)
     )
     await comment.create()
     
-    post.comments_count += 1
-    await post.save()
-    
     # Notify author
-    if str(post.author.id) != str(current_user.id):
-        notif = Notification(
-            recipient=post.author,
-            sender_id=str(current_user.id),
-            sender_name=current_user.display_name,
-            sender_avatar=current_user.avatar_url,
-            type="post_comment",
-            related_id=post_id,
-            content=f"đã bình luận về bài viết của bạn"
-        )
-        await notif.create()
-        ws_msg = json.dumps({
-            "type": "post_comment",
-            "payload": {
-                "type": "post_comment",
-                "userId": str(current_user.id),
-                "userDisplayName": current_user.display_name,
-                "avatar": current_user.avatar_url,
-                "postId": post_id
-            }
-        })
-        await manager.send_personal_message(ws_msg, str(post.author.id))
+    await notifications.notify(
+        str(link_id(post.author)), current_user, "post_comment", post_id,
+        "đã bình luận về bài viết của bạn"
+    )
 
     return CommentOut.from_doc(comment)
 
 @router.get("/{post_id}/comments", response_model=List[CommentOut])
-async def get_comments(post_id: str):
-    comments = await Comment.find(
-        Comment.post_id == PydanticObjectId(post_id),
-        fetch_links=True
-    ).sort(Comment.created_at).to_list()
-    return [CommentOut.from_doc(c) for c in comments]
+async def get_comments(
+    post_id: str,
+    response: Response,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+):
+    # Oldest first. Without a limit every comment is returned (legacy clients).
+    query = {"post_id": PydanticObjectId(post_id)}
+    query.update(keyset_filter("created_at", cursor, descending=False))
+    find = Comment.find(query).sort([("created_at", 1), ("_id", 1)])
+    if limit:
+        find = find.limit(limit)
+    comments = await find.to_list()
+    if limit:
+        set_next_cursor(response, comments, limit, lambda c: (c.created_at, c.id))
+
+    users = DocumentLoader(User, user_cache)
+    users.add_many(c.author for c in comments)
+    await users.load()
+    return [CommentOut.from_doc(c, users) for c in comments]
 
 @router.delete("/comments/{comment_id}")
 async def delete_comment(
     comment_id: str,
     current_user: User = Depends(get_current_user)
 ):
-    comment = await Comment.get(comment_id, fetch_links=True)
+    comment = await Comment.get(comment_id)
     if not comment:
         raise HTTPException(status_code=404, detail="Comment not found")
         
     # Permission: only author or post author can delete
-    post = await Post.get(str(comment.post_id), fetch_links=True)
-    if str(comment.author.id) != str(current_user.id) and (not post or str(post.author.id) != str(current_user.id)):
-        raise HTTPException(status_code=403, detail="Not authorized")
+    if link_id(comment.author) != current_user.id:
+        post = await Post.get(comment.post_id)
+        if not post or link_id(post.author) != current_user.id:
+            raise HTTPException(status_code=403, detail="Not authorized")
         
     await comment.delete()
-    if post:
-        post.comments_count = max(0, post.comments_count - 1)
-        await post.save()
+    await Post.find_one({"_id": comment.post_id, "comments_count": {"$gt": 0}}).update(
+        {"$inc": {"comments_count": -1}}
+    )
     return {"message": "Comment deleted"}
 
 @router.put("/comments/{comment_id}", response_model=CommentOut)
@@ -365,15 +312,15 @@ async def update_comment(
     content: str = Body(..., embed=True),
     current_user: User = Depends(get_current_user)
 ):
-    comment = await Comment.get(comment_id, fetch_links=True)
+    comment = await Comment.get(comment_id)
     if not comment:
         raise HTTPException(status_code=404, detail="Comment not found")
         
-    if str(comment.author.id) != str(current_user.id):
+    if link_id(comment.author) != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
         
-    comment.content = content
-    await comment.save()
+    await comment.set({Comment.content: content, Comment.search_terms: search.content_terms(content)})
+    comment.author = current_user
     return CommentOut.from_doc(comment)
 
 @router.delete("/{post_id}")
@@ -389,4 +336,8 @@ async def delete_post(
         raise HTTPException(status_code=403, detail="Not authorized")
         
     await post.delete()
+    # Its comments go too, so they stop showing up in comment search
+    await Comment.find({"post_id": post.id}).delete()
+    await timeline.remove_post(post.id)
+    await reactions.delete_post_reactions(post.id)
     return {"message": "Post deleted"}
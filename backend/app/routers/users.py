@@ -1,12 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException, Body, Form, UploadFile, File, Request
+from fastapi import APIRouter, Depends, HTTPException, Body, Form, UploadFile, File, Request, Response
 from typing import List, Any, Optional
 from app.models.user import User, UserOut
 from app.models.friend_request import FriendRequest, FriendRequestOut
 from app.core.deps import get_current_user
 from beanie import PydanticObjectId
+from app.core.loader import DocumentLoader
+from app.core.cache import user_cache
+from app.services import timeline, media, images, search
+from app.core.pagination import set_next_cursor
+from app.core.config import settings
 
 router = APIRouter()
 
+async def _add_friendship(user: User, other_id: PydanticObjectId):
+    # $addToSet on both sides: idempotent, no read-modify-write of the friend lists
+    await User.find_one({"_id": user.id}).update({"$addToSet": {"friends": str(other_id)}})
+    await User.find_one({"_id": other_id}).update({"$addToSet": {"friends": str(user.id)}})
+    user_cache.invalidate(user.id, other_id)
+
+    other = await user_cache.get(other_id)
+    if other:
+        await timeline.backfill_from_author(user, other)
+        await timeline.backfill_from_author(other, user)
+
 @router.get("/me", response_model=UserOut)
 async def read_user_me(current_user: User = Depends(get_current_user)):
     return current_user
@@ -21,65 +37,50 @@ async def update_user_me(
     background: Optional[UploadFile] = File(None),
     current_user: User = Depends(get_current_user)
 ):
-    import os
-    static_dir = "static"
-    if not os.path.exists(static_dir):
-        os.makedirs(static_dir)
-
+    # Only changed fields are written ($set), not the whole user document
+    updates = {}
     if displayName:
-        current_user.display_name = displayName
+        updates[User.display_name] = displayName
+        updates[User.search_keys] = search.user_search_keys(current_user.username, displayName)
     if bio:
-        current_user.bio = bio
+        updates[User.bio] = bio
     if isPublicEmail is not None:
-        current_user.is_public_email = isPublicEmail
+        updates[User.is_public_email] = isPublicEmail
         
-    base_url = str(request.base_url).rstrip("/")
-    
     if avatar:
-        filename = f"avatar_{current_user.id}_{avatar.filename.replace(' ', '_')}"
-        file_path = os.path.join(static_dir, filename)
-        content_bytes = await avatar.read()
-        with open(file_path, "wb") as buffer:
-            buffer.write(content_bytes)
-        current_user.avatar_url = f"{base_url}/static/{filename}"
+        path = await media.save_upload(avatar, settings.MEDIA_MAX_AVATAR_BYTES)
+        updates[User.avatar_url] = media.public_url(request, path)
+        updates[User.avatar_variants] = {}
         
     if background:
-        filename = f"bg_{current_user.id}_{background.filename.replace(' ', '_')}"
-        file_path = os.path.join(static_dir, filename)
-        content_bytes = await background.read()
-        with open(file_path, "wb") as buffer:
-            buffer.write(content_bytes)
-        current_user.background_url = f"{base_url}/static/{filename}"
+        path = await media.save_upload(background, settings.MEDIA_MAX_AVATAR_BYTES)
+        updates[User.background_url] = media.public_url(request, path)
         
-    await current_user.save()
+    if updates:
+        await current_user.set(updates)
+        user_cache.invalidate(current_user.id)
+    if avatar:
+        images.schedule_avatar_variants(current_user.id, current_user.avatar_url)
     return current_user
 
 @router.get("/search", response_model=List[UserOut])
 async def search_users(
     query: str,
+    response: Response,
+    limit: int = 20,
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user)
 ):
-    users = await User.find(
-        {
-            "$or": [
-                {"username": {"$regex": query, "$options": "i"}},
-                {"display_name": {"$regex": query, "$options": "i"}}
-            ]
-        }
-    ).to_list()
+    # Prefix match on folded names (app.services.search), friends first
+    limit = max(1, min(limit, settings.SEARCH_MAX_LIMIT))
+    users, page = await search.search_users(current_user, query, limit, cursor)
+    set_next_cursor(response, page, limit, lambda u: (u.created_at, u.id))
     return users
 
 @router.get("/friends", response_model=List[UserOut])
 async def get_friends(current_user: User = Depends(get_current_user)):
-    friend_ids = []
-    for fid in current_user.friends:
-        try:
-            friend_ids.append(PydanticObjectId(fid))
-        except Exception:
-            continue
-            
-    friends = await User.find({"_id": {"$in": friend_ids}}).to_list()
-    return friends
+    friends = await user_cache.get_many(current_user.friends)
+    return list(friends.values())
 
 @router.post("/batch", response_model=List[UserOut])
 async def get_users_batch(
@@ -87,26 +88,23 @@ async def get_users_batch(
     current_user: User = Depends(get_current_user)
 ):
     user_ids = data.get("user_ids", [])
-    ids = []
-    for uid in user_ids:
-        try:
-            ids.append(PydanticObjectId(uid))
-        except:
-            continue
-    users = await User.find({"_id": {"$in": ids}}).to_list()
-    return users
+    users = await user_cache.get_many(user_ids)
+    return list(users.values())
 
 @router.get("/friend-requests/pending")
 async def get_pending_requests(current_user: User = Depends(get_current_user)):
     requests = await FriendRequest.find(
         FriendRequest.to_user.id == current_user.id,
-        FriendRequest.status == "pending",
-        fetch_links=True
+        FriendRequest.status == "pending"
     ).to_list()
+
+    users = DocumentLoader(User, user_cache)
+    users.add_many(req.from_user for req in requests)
+    await users.load()
     
     result = []
     for req in requests:
-        out = await FriendRequestOut.from_doc(req)
+        out = await FriendRequestOut.from_doc(req, users)
         result.append(out.model_dump(by_alias=True))
     return result
 
@@ -155,19 +153,12 @@ async def respond_to_request(
         raise HTTPException(status_code=403, detail="Not authorized")
         
     if response == "accepted" or response == "accept":
-        req.status = "accepted"
-        # Add to friends list
-        from_user = await User.get(req.from_user.ref.id)
-        if str(from_user.id) not in current_user.friends:
-            current_user.friends.append(str(from_user.id))
-            await current_user.save()
-        if str(current_user.id) not in from_user.friends:
-            from_user.friends.append(str(current_user.id))
-            await from_user.save()
+        status = "accepted"
+        await _add_friendship(current_user, req.from_user.ref.id)
     else:
-        req.status = "rejected"
+        status = "rejected"
         
-    await req.save()
+    await req.set({FriendRequest.status: status})
     return {"message": f"Request {response}"}
 
 @router.post("/friend-request/by-user/{user_id}")
@@ -186,18 +177,12 @@ async def respond_to_request_by_user(
         raise HTTPException(status_code=404, detail="Request not found")
         
     if response == "accept" or response == "accepted":
-        req.status = "accepted"
-        from_user = await User.get(req.from_user.ref.id)
-        if str(from_user.id) not in current_user.friends:
-            current_user.friends.append(str(from_user.id))
-            await current_user.save()
-        if str(current_user.id) not in from_user.friends:
-            from_user.friends.append(str(current_user.id))
-            await from_user.save()
+        status = "accepted"
+        await _add_friendship(current_user, req.from_user.ref.id)
     else:
-        req.status = "rejected"
+        status = "rejected"
         
-    await req.save()
+    await req.set({FriendRequest.status: status})
     return {"message": f"Request {response}"}
 
 @router.delete("/friend-request/{user_id}")
@@ -231,21 +216,21 @@ async def cancel_friend_request(
 async def block_user(data: dict = Body(...), current_user: User = Depends(get_current_user)):
     user_id = data.get("user_id")
     if user_id not in current_user.blocked_users:
-        current_user.blocked_users.append(user_id)
-        await current_user.save()
+        await User.find_one({"_id": current_user.id}).update({"$addToSet": {"blocked_users": user_id}})
+        user_cache.invalidate(current_user.id)
     return {"message": "User blocked"}
 
 @router.post("/unblock")
 async def unblock_user(data: dict = Body(...), current_user: User = Depends(get_current_user)):
     user_id = data.get("user_id")
     if user_id in current_user.blocked_users:
-        current_user.blocked_users.remove(user_id)
-        await current_user.save()
+        await User.find_one({"_id": current_user.id}).update({"$pull": {"blocked_users": user_id}})
+        user_cache.invalidate(current_user.id)
     return {"message": "User unblocked"}
 
 @router.get("/block-status/{other_user_id}")
 async def check_block_status(other_user_id: str, current_user: User = Depends(get_current_user)):
-    other_user = await User.get(other_user_id)
+    other_user = await user_cache.get(other_user_id)
     if not other_user:
         raise HTTPException(status_code=404, detail="User not found")
         
@@ -293,12 +278,11 @@ async def get_blocked_users(user_id: str, current_user: User = Depends(get_curre
 @router.post("/{user_id}/unfriend")
 async def unfriend_user(user_id: str, current_user: User = Depends(get_current_user)):
     if user_id in current_user.friends:
-        current_user.friends.remove(user_id)
-        await current_user.save()
-        other_user = await User.get(user_id)
-        if other_user and str(current_user.id) in other_user.friends:
-            other_user.friends.remove(str(current_user.id))
-            await other_user.save()
+        await User.find_one({"_id": current_user.id}).update({"$pull": {"friends": user_id}})
+        await User.find_one({"_id": PydanticObjectId(user_id)}).update({"$pull": {"friends": str(current_user.id)}})
+        user_cache.invalidate(current_user.id, user_id)
+        await timeline.remove_author_from_timeline(current_user.id, PydanticObjectId(user_id))
+        await timeline.remove_author_from_timeline(PydanticObjectId(user_id), current_user.id)
     return {"message": "Unfriended"}
 
 @router.get("/{user_id}", response_model=UserOut)
@@ -307,7 +291,7 @@ async def read_user_by_id(
     current_user: User = Depends(get_current_user)
 ):
     try:
-        user = await User.get(user_id)
+        user = await user_cache.get(user_id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         return user
@@ -0,0 +1,129 @@
+from typing import List, Optional
+from beanie import PydanticObjectId, UpdateResponse
+
+from app.models.message import Message, Conversation, MessageOut
+from app.models.user import User
+from app.core.cache import TTLCache
+from app.core.links import link_eq, link_id, to_object_id
+from app.core.realtime import manager, encode_frame
+from app.services import unread
+
+# Chat persistence shared by the HTTP routes and the WebSocket protocol, so a
+# message sent either way is stored, summarized and fanned out identically.
+
+# conversation id -> participant user ids, for high-frequency frames like typing
+_participants = TTLCache(maxsize=10000, ttl=30)
+
+async def participant_ids(conversation_id: PydanticObjectId) -> List[str]:
+    ids = _participants.get(conversation_id)
+    if ids is None:
+        doc = await Conversation.get_motor_collection().find_one(
+            {"_id": conversation_id}, {"participants": 1}
+        )
+        ids = [str(ref.id) for ref in doc.get("participants", [])] if doc else []
+        _participants.set(conversation_id, ids)
+    return ids
+
+async def is_participant(conversation_id: str, user_id) -> bool:
+    conv_oid = to_object_id(conversation_id)
+    return conv_oid is not None and str(user_id) in await participant_ids(conv_oid)
+
+async def post_message(
+    conversation_id: str,
+    sender: User,
+    message_type: str,
+    text: Optional[str] = None,
+    file_urls: Optional[List[str]] = None
+) -> Optional[dict]:
+    # Returns the serialized message, or None if the conversation doesn't exist
+    # or the sender isn't a participant
+    conv_oid = to_object_id(conversation_id)
+    if conv_oid is None:
+        return None
+
+    message = Message(
+        conversation_id=conv_oid,
+        sender=sender,
+        message_type=message_type,
+        text=text,
+        file_urls=file_urls or []
+    )
+
+    # Update last message with a targeted $set; the returned document (links
+    # unfetched) gives the participant ids without a separate read
+    conv = await Conversation.find_one(
+        {"_id": conv_oid, **link_eq("participants", sender.id)}
+    ).update(
+        {"$set": {
+            "last_message": {
+                "content_type": message_type,
+                "text": text,
+                "sender_id": str(sender.id),
+                "timestamp": message.timestamp.isoformat()
+            },
+            "updated_at": message.timestamp,
+            "seen_ids": [str(sender.id)]
+        }},
+        response_type=UpdateResponse.NEW_DOCUMENT
+    )
+    if not conv:
+        return None
+
+    await message.create()
+
+    # Notify via WS
+    msg_out = await MessageOut.from_doc(message)
+    msg_data = msg_out.model_dump(by_alias=True)
+    ws_msg = encode_frame("new_message", {
+        "message": msg_data,
+        "conversation": {
+            "participantCount": len(conv.participants)
+        }
+    })
+
+    # Encoded once, enqueued on every recipient's connection; slow sockets don't hold the response
+    recipients = [str(link_id(p)) for p in conv.participants if link_id(p) != sender.id]
+    await manager.broadcast(ws_msg, recipients)
+    await unread.add_messages(conversation_id, recipients)
+    return msg_data
+
+async def mark_seen(conversation_id: str, user: User) -> bool:
+    conv_oid = to_object_id(conversation_id)
+    if conv_oid is None:
+        return False
+    # Participants only, like post_message
+    result = await Conversation.find_one(
+        {"_id": conv_oid, **link_eq("participants", user.id)}
+    ).update(
+        {"$addToSet": {"seen_ids": str(user.id)}}
+    )
+    if result.matched_count == 0:
+        return False
+    await unread.reset_conversation(user.id, conversation_id)
+
+    # Let the user's other devices refresh their unread state
+    await manager.send_personal_message(
+        encode_frame("conversation_seen", {
+            "conversationId": conversation_id,
+            "userId": str(user.id)
+        }),
+        str(user.id)
+    )
+    return True
+
+async def send_typing(conversation_id: str, user_id: str, is_typing: bool) -> bool:
+    conv_oid = to_object_id(conversation_id)
+    if conv_oid is None:
+        return False
+    ids = await participant_ids(conv_oid)
+    if user_id not in ids:
+        return False
+    await manager.broadcast(
+        encode_frame("typing", {
+            "conversationId": conversation_id,
+            "userId": user_id,
+            "isTyping": is_typing
+        }),
+        [pid for pid in ids if pid != user_id]
+    )
+    return True
@@ -0,0 +1,125 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Set
+
+from beanie import PydanticObjectId
+
+from app.core.config import settings
+from app.core.variants import content_key, media_filename
+from app.models.post import Post
+from app.models.user import User
+from app.core.cache import user_cache
+from app.services.media import media_dir
+
+try:
+    from PIL import Image, ImageOps
+except ImportError: # optional, without Pillow only originals are served
+    Image = None
+
+# Resized, recompressed copies of uploaded images (posts and avatars). Decoding
+# and resizing are CPU bound, so they run in a process pool after the upload
+# response has gone out; documents pick up the variant names when ready.
+
+VARIANT_WIDTHS = {"thumb": 160, "small": 480, "medium": 1080}
+AVATAR_WIDTHS = {"thumb": 96, "small": 320}
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+_tasks: Set[asyncio.Task] = set()
+
+def _render_variants(src_path: str, widths: Dict[str, int]) -> Dict[str, str]:
+    # Runs in a worker process. Variants are content addressed like the
+    # original, so existing files are reused rather than re-rendered.
+    stem = os.path.splitext(src_path)[0]
+    names = {}
+    with Image.open(src_path) as original:
+        img = ImageOps.exif_transpose(original)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+        for size, width in widths.items():
+            if img.width <= width:
+                # The original is already small enough
+                continue
+            path = f"{stem}.{size}.webp"
+            if not os.path.exists(path):
+                height = max(1, round(img.height * width / img.width))
+                tmp_path = f"{path}.tmp"
+                img.resize((width, height), Image.LANCZOS).save(tmp_path, "WEBP", quality=80, method=4)
+                os.replace(tmp_path, path)
+            names[size] = os.path.basename(path)
+    return names
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, not fork: the server process already runs motor, threadpool and
+        # bcrypt threads whose held locks a forked child would inherit
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+def shutdown():
+    global _pool
+    for task in list(_tasks):
+        task.cancel()
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def _source_path(url: str) -> Optional[str]:
+    name = media_filename(url)
+    if not name or os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+        return None
+    path = os.path.join(media_dir(), name)
+    return path if os.path.exists(path) else None
+
+async def render(url: str, widths: Dict[str, int] = VARIANT_WIDTHS) -> Dict[str, str]:
+    path = _source_path(url)
+    if Image is None or path is None:
+        return {}
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_pool(), _render_variants, path, widths)
+    except Exception as e:
+        print(f"Image variants failed for {url}: {e}")
+        return {}
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+async def _post_variants(post_id: PydanticObjectId, urls: List[str]):
+    updates = {}
+    for url in urls:
+        names = await render(url)
+        if names:
+            updates[f"media_variants.{content_key(url)}"] = names
+    if updates:
+        await Post.find_one({"_id": post_id}).update({"$set": updates})
+
+async def _avatar_variants(user_id: PydanticObjectId, url: str):
+    names = await render(url, AVATAR_WIDTHS)
+    if not names:
+        return
+    # Only if the avatar wasn't changed again in the meantime
+    await User.find_one(User.id == user_id, User.avatar_url == url).update(
+        {"$set": {User.avatar_variants: names}}
+    )
+    user_cache.invalidate(user_id)
+
+def schedule_post_variants(post: Post):
+    urls = [
+        url for url in post.image_urls
+        if content_key(url) not in post.media_variants and _source_path(url)
+    ]
+    if urls and Image is not None:
+        _spawn(_post_variants(post.id, urls))
+
+def schedule_avatar_variants(user_id: PydanticObjectId, url: str):
+    if Image is not None and _source_path(url):
+        _spawn(_avatar_variants(user_id, url))
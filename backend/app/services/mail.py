@@ -0,0 +1,36 @@
+from fastapi_mail import ConnectionConfig, FastMail, MessageSchema, MessageType
+
+from app.core.config import settings
+from app.core.jobs import jobs
+
+# Outgoing mail goes through the job queue: SMTP latency and transient
+# failures (retried with backoff) stay out of the request.
+
+conf = ConnectionConfig(
+    MAIL_USERNAME=settings.MAIL_USERNAME,
+    MAIL_PASSWORD=settings.MAIL_PASSWORD,
+    MAIL_FROM=settings.MAIL_FROM,
+    MAIL_PORT=settings.MAIL_PORT,
+    MAIL_SERVER=settings.MAIL_SERVER,
+    MAIL_FROM_NAME=settings.MAIL_FROM_NAME,
+    MAIL_STARTTLS=True,
+    MAIL_SSL_TLS=False,
+    USE_CREDENTIALS=True,
+    VALIDATE_CERTS=True
+)
+
+def mail_enabled() -> bool:
+    return bool(settings.MAIL_USERNAME and settings.MAIL_PASSWORD)
+
+@jobs.handler("send_otp_email")
+async def send_otp_email(email: str, otp: str):
+    message = MessageSchema(
+        subject="Mã xác thực OTP - Relo Social",
+        recipients=[email],
+        body=f"Mã OTP của bạn là: {otp}. Vui lòng không cung cấp mã này cho bất kỳ ai.",
+        subtype=MessageType.plain
+    )
+    fm = FastMail(conf)
+    # Raising lets the job queue retry
+    await fm.send_message(message)
+    print(f"DEBUG: Real Email sent to {email}")
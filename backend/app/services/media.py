@@ -0,0 +1,106 @@
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from typing import List, Optional
+
+from fastapi import HTTPException, Request, UploadFile
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+
+# Media ingest shared by posts, avatars and message attachments. Uploads are
+# copied to disk in chunks on a worker thread (never read whole into memory,
+# never blocking the event loop) and stored under their SHA-256, so the same
+# file uploaded twice is kept once and its URL never changes meaning.
+
+MEDIA_SUBDIR = "media"
+CHUNK_SIZE = 1024 * 1024
+
+_EXT_RE = re.compile(r"^\.[a-z0-9]{1,10}$")
+
+# Text-like formats get a .gz sibling that /static serves to gzip clients;
+# images, audio and video are already compressed
+COMPRESSIBLE_EXTENSIONS = {".txt", ".csv", ".json", ".svg", ".xml", ".html", ".md"}
+
+class UploadTooLarge(Exception):
+    pass
+
+def media_dir() -> str:
+    return os.path.join(settings.MEDIA_ROOT, MEDIA_SUBDIR)
+
+def _extension(filename: Optional[str]) -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext if _EXT_RE.match(ext) else ""
+
+def _precompress(path: str):
+    tmp_path = f"{path}.gz.tmp"
+    with open(path, "rb") as src, gzip.open(tmp_path, "wb", compresslevel=9) as out:
+        shutil.copyfileobj(src, out, CHUNK_SIZE)
+    os.replace(tmp_path, f"{path}.gz")
+
+def _ingest(src, ext: str, max_bytes: int) -> str:
+    # Runs in the threadpool: copy + hash in one pass, then move into place
+    target_dir = media_dir()
+    os.makedirs(target_dir, exist_ok=True)
+    hasher = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=target_dir, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            src.seek(0)
+            while True:
+                chunk = src.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge()
+                hasher.update(chunk)
+                out.write(chunk)
+
+        name = f"{hasher.hexdigest()}{ext}"
+        final_path = os.path.join(target_dir, name)
+        if os.path.exists(final_path):
+            # Identical content already stored
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, final_path)
+            if ext in COMPRESSIBLE_EXTENSIONS:
+                _precompress(final_path)
+        return f"{MEDIA_SUBDIR}/{name}"
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+async def save_upload(file: UploadFile, max_bytes: Optional[int] = None) -> str:
+    # Returns the path relative to the static root, e.g. "media/<sha256>.jpg"
+    limit = max_bytes or settings.MEDIA_MAX_UPLOAD_BYTES
+    try:
+        return await run_in_threadpool(_ingest, file.file, _extension(file.filename), limit)
+    except UploadTooLarge:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File {file.filename} exceeds {limit // (1024 * 1024)} MB"
+        )
+    finally:
+        await file.close()
+
+def public_url(request: Request, path: str) -> str:
+    base_url = str(request.base_url).rstrip("/")
+    return f"{base_url}/static/{path}"
+
+async def save_uploads(
+    request: Request,
+    files: Optional[List[UploadFile]],
+    max_bytes: Optional[int] = None
+) -> List[str]:
+    urls = []
+    for file in files or []:
+        if not file.filename:
+            continue
+        urls.append(public_url(request, await save_upload(file, max_bytes)))
+    return urls
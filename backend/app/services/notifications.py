@@ -0,0 +1,170 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set, Tuple
+
+from bson import DBRef
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.core.config import settings
+from app.core.jobs import jobs
+from app.core.links import to_object_id
+from app.core.realtime import manager, encode_frame
+from app.models.notification import Notification
+from app.models.user import User
+from app.services import unread
+
+# Post notifications (share, reaction, comment) are written and pushed by a job
+# worker, so react/comment/share respond without waiting on either.
+#
+# Reactions and comments on the same post are coalesced: while the recipient
+# hasn't read it and activity keeps coming within NOTIFICATION_COALESCE_SECONDS,
+# every event upserts one notification per (recipient, type, post) ("X and 41
+# others reacted"), and WebSocket pushes for it are debounced. The open group
+# is identified by a unique group_key, which is dropped when the notification
+# is read or the group goes quiet.
+
+COALESCE_TYPES = {"post_reaction", "post_comment"}
+# Most recent distinct actors kept on an aggregated notification
+MAX_ACTORS = 20
+
+# (recipient, type, related_id) -> latest frame not pushed yet (None: nothing new)
+_debounced: Dict[Tuple[str, str, str], Optional[str]] = {}
+_flushes: Set[asyncio.Task] = set()
+
+def _group_update(sender_id: str, latest: dict) -> list:
+    # Pipeline update: the sender joins the distinct actor set, moves to the
+    # front of the capped recent list, and actor_count follows the set
+    actors = {"$ifNull": ["$actors", {"$ifNull": ["$actor_ids", []]}]}
+    recent = {"$filter": {"input": {"$ifNull": ["$actor_ids", []]}, "cond": {"$ne": ["$$this", sender_id]}}}
+    return [
+        {"$set": {
+            **{k: {"$literal": v} for k, v in latest.items()},
+            "actors": {"$setUnion": [actors, [sender_id]]},
+            "actor_ids": {"$slice": [{"$concatArrays": [[sender_id], recent]}, MAX_ACTORS]},
+        }},
+        {"$set": {"actor_count": {"$size": "$actors"}}},
+    ]
+
+async def _coalesce(
+    recipient_id: str,
+    sender_id: str,
+    latest: dict,
+    type: str,
+    related_id: str
+) -> Tuple[int, bool]:
+    # One upsert per event; returns (actor_count, created)
+    recipient = to_object_id(recipient_id)
+    key = f"{recipient_id}:{type}:{related_id}"
+    cutoff = latest["created_at"] - timedelta(seconds=settings.NOTIFICATION_COALESCE_SECONDS)
+    collection = Notification.get_motor_collection()
+    for _ in range(2):
+        try:
+            before = await collection.find_one_and_update(
+                {
+                    # Equality fields are copied into the document on insert
+                    "group_key": key,
+                    "recipient": DBRef(User.get_motor_collection().name, recipient),
+                    "type": type,
+                    "related_id": related_id,
+                    "is_read": False,
+                    "created_at": {"$gte": cutoff},
+                },
+                _group_update(sender_id, latest),
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            # The open group went quiet (or was read without closing): close it
+            # and start a new one. A concurrent insert just matches on retry.
+            await collection.update_one(
+                {"group_key": key, "$or": [{"is_read": True}, {"created_at": {"$lt": cutoff}}]},
+                {"$unset": {"group_key": ""}}
+            )
+            continue
+        if before is None:
+            return 1, True
+        actors = set(before.get("actors") or before.get("actor_ids") or [])
+        actors.add(sender_id)
+        return len(actors), False
+    raise RuntimeError(f"Could not coalesce notification {key}")
+
+async def _push(recipient_id: str, key: Tuple[str, str, str], frame: str):
+    # Leading push right away, then at most one trailing push per debounce
+    # window carrying the latest state
+    if key in _debounced:
+        _debounced[key] = frame
+        return
+    _debounced[key] = None
+    await manager.send_personal_message(frame, recipient_id)
+    task = asyncio.create_task(_flush_later(recipient_id, key))
+    _flushes.add(task)
+    task.add_done_callback(_flushes.discard)
+
+async def _flush_later(recipient_id: str, key: Tuple[str, str, str]):
+    await asyncio.sleep(settings.NOTIFICATION_PUSH_DEBOUNCE_SECONDS)
+    frame = _debounced.pop(key, None)
+    if frame is not None:
+        await manager.send_personal_message(frame, recipient_id)
+
+@jobs.handler("notify")
+async def deliver_notification(
+    recipient_id: str,
+    sender_id: str,
+    sender_name: str,
+    sender_avatar: Optional[str],
+    type: str,
+    related_id: str,
+    content: str
+):
+    # created_at tracks the latest activity so coalesced notifications move
+    # back to the top of the list
+    latest = {
+        "sender_id": sender_id,
+        "sender_name": sender_name,
+        "sender_avatar": sender_avatar,
+        "content": content,
+        "created_at": datetime.now(),
+    }
+    if type in COALESCE_TYPES:
+        actor_count, created = await _coalesce(recipient_id, sender_id, latest, type, related_id)
+    else:
+        await Notification(
+            recipient=User.link_from_id(to_object_id(recipient_id)),
+            type=type,
+            related_id=related_id,
+            actor_ids=[sender_id],
+            actors=[sender_id],
+            **latest
+        ).create()
+        actor_count, created = 1, True
+    if created:
+        await unread.add_notifications(recipient_id)
+
+    ws_msg = encode_frame(type, {
+        "type": type,
+        "userId": sender_id, # Sender
+        "userDisplayName": sender_name,
+        "avatar": sender_avatar,
+        "postId": related_id,
+        "actorCount": actor_count
+    })
+    if type in COALESCE_TYPES:
+        await _push(recipient_id, (recipient_id, type, related_id), ws_msg)
+    else:
+        await manager.send_personal_message(ws_msg, recipient_id)
+
+async def notify(recipient_id: str, sender: User, type: str, related_id: str, content: str):
+    # Enqueue only; nothing to notify when users act on their own posts
+    if recipient_id == str(sender.id):
+        return
+    await jobs.enqueue(
+        "notify",
+        recipient_id=recipient_id,
+        sender_id=str(sender.id),
+        sender_name=sender.display_name,
+        sender_avatar=sender.avatar_url,
+        type=type,
+        related_id=related_id,
+        content=content
+    )
@@ -0,0 +1,95 @@
+from typing import Dict, Optional
+from datetime import datetime
+from beanie import PydanticObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
+from app.models.post import Post
+from app.models.reaction import PostReaction
+
+# Reactions live in post_reactions (one row per post/user) and Post keeps
+# per-type totals in reaction_counts, updated with $inc. A react request is a
+# single upsert plus at most one counter update, whatever the post's size.
+
+async def migrate_legacy_reactions(post: Post):
+    # Posts written before post_reactions existed embed every reaction; move
+    # them out once so later reads and writes don't carry the array around
+    if not post.reactions:
+        return
+    rows = []
+    counts: Dict[str, int] = {}
+    for r in post.reactions:
+        try:
+            user_id = PydanticObjectId(r.user_id)
+        except Exception:
+            continue
+        rows.append({
+            "post_id": post.id,
+            "user_id": user_id,
+            "type": r.type,
+            "created_at": post.updated_at,
+        })
+        counts[r.type] = counts.get(r.type, 0) + 1
+    if rows:
+        try:
+            await PostReaction.get_motor_collection().insert_many(rows, ordered=False)
+        except BulkWriteError:
+            pass
+    await Post.get_motor_collection().update_one(
+        {"_id": post.id, "reactions.0": {"$exists": True}},
+        {"$set": {"reaction_counts": counts, "reactions": []}}
+    )
+    post.reaction_counts = counts
+    post.reactions = []
+
+async def set_reaction(post: Post, user_id: PydanticObjectId, reaction_type: str) -> Optional[str]:
+    # Returns the previous reaction type (None if the user had not reacted)
+    await migrate_legacy_reactions(post)
+
+    previous = await PostReaction.get_motor_collection().find_one_and_update(
+        {"post_id": post.id, "user_id": user_id},
+        {
+            "$set": {"type": reaction_type, "created_at": datetime.now()},
+        },
+        upsert=True,
+        projection={"_id": 0, "type": 1},
+        return_document=ReturnDocument.BEFORE,
+    )
+    previous_type = previous["type"] if previous else None
+    if previous_type == reaction_type:
+        return previous_type
+
+    inc = {f"reaction_counts.{reaction_type}": 1}
+    if previous_type:
+        inc[f"reaction_counts.{previous_type}"] = -1
+    await Post.get_motor_collection().update_one({"_id": post.id}, {"$inc": inc})
+
+    # Mirror the change locally so the response doesn't need a re-read
+    counts = dict(post.reaction_counts)
+    counts[reaction_type] = counts.get(reaction_type, 0) + 1
+    if previous_type:
+        counts[previous_type] = max(0, counts.get(previous_type, 0) - 1)
+    post.reaction_counts = counts
+    return previous_type
+
+async def remove_reaction(post: Post, user_id: PydanticObjectId) -> Optional[str]:
+    await migrate_legacy_reactions(post)
+
+    previous = await PostReaction.get_motor_collection().find_one_and_delete(
+        {"post_id": post.id, "user_id": user_id},
+        projection={"_id": 0, "type": 1},
+    )
+    if not previous:
+        return None
+    previous_type = previous["type"]
+    await Post.get_motor_collection().update_one(
+        {"_id": post.id},
+        {"$inc": {f"reaction_counts.{previous_type}": -1}}
+    )
+    counts = dict(post.reaction_counts)
+    counts[previous_type] = max(0, counts.get(previous_type, 0) - 1)
+    post.reaction_counts = counts
+    return previous_type
+
+async def delete_post_reactions(post_id: PydanticObjectId):
+    await PostReaction.find(PostReaction.post_id == post_id).delete()
@@ -0,0 +1,193 @@
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from app.core.config import settings
+from app.core.jobs import jobs
+from app.core.links import link_in, to_object_ids
+from app.core.pagination import keyset_filter
+from app.core.text import fold, tokenize, edge_ngrams
+from app.models.user import User
+from app.models.post import Post
+from app.models.comment import Comment
+
+# User search. Every user carries search_keys: the edge n-grams of the folded
+# words of their username and display name, behind a multikey index. A query
+# "nguyen v" becomes {"search_keys": {"$all": ["nguyen", "v"]}}, an anchored
+# index lookup instead of an unanchored $regex over the whole collection, and
+# user input never reaches a regex.
+
+BACKFILL_BATCH = 500
+MAX_QUERY_TOKENS = 5
+
+def user_search_keys(username: str, display_name: str) -> List[str]:
+    tokens = tokenize(username) + tokenize(display_name)
+    # "john_doe" is also found as "johndoe"
+    tokens.append("".join(tokenize(username)))
+    return edge_ngrams(tokens, settings.SEARCH_MAX_PREFIX)
+
+def _query_tokens(query: str) -> List[str]:
+    return tokenize(query)[:MAX_QUERY_TOKENS]
+
+def _matches(user: User, tokens: List[str]) -> bool:
+    # Only needed for tokens longer than the indexed prefixes
+    words = tokenize(user.username) + tokenize(user.display_name)
+    return all(any(word.startswith(token) for word in words) for token in tokens)
+
+def _rank(user: User, query: str) -> tuple:
+    name = fold(user.display_name)
+    username = fold(user.username)
+    return (username != query, not name.startswith(query), name)
+
+async def search_users(
+    viewer: User,
+    query: str,
+    limit: int,
+    cursor: Optional[str] = None
+) -> Tuple[List[User], List[User]]:
+    # Returns (results, page). First page: matching friends (at most limit),
+    # best match first. Then everyone else, newest accounts first, limit per
+    # page; page is that raw slice, for the next cursor.
+    tokens = _query_tokens(query)
+    if not tokens:
+        return [], []
+    match = {
+        "search_keys": {"$all": [t[:settings.SEARCH_MAX_PREFIX] for t in tokens]},
+        # Blocks hide users both ways
+        "blocked_users": {"$ne": str(viewer.id)},
+    }
+    exact = any(len(t) > settings.SEARCH_MAX_PREFIX for t in tokens)
+
+    blocked = set(to_object_ids(viewer.blocked_users))
+    friend_ids = [oid for oid in to_object_ids(viewer.friends) if oid not in blocked]
+    excluded = [viewer.id] + list(blocked) + friend_ids
+
+    friends = []
+    if not cursor and friend_ids:
+        friends = await User.find({**match, "_id": {"$in": friend_ids}}).limit(limit).to_list()
+        folded = " ".join(tokens)
+        friends.sort(key=lambda u: _rank(u, folded))
+
+    others_query = {**match, "_id": {"$nin": excluded}}
+    others_query.update(keyset_filter("created_at", cursor))
+    others = await User.find(others_query).sort(
+        [("created_at", -1), ("_id", -1)]
+    ).limit(limit).to_list()
+
+    results = friends + others
+    if exact:
+        results = [u for u in results if _matches(u, tokens)]
+    return results, others
+
+@jobs.handler("backfill_user_search_keys")
+async def backfill_user_search_keys():
+    # Users created before search_keys existed; runs once at startup
+    collection = User.get_motor_collection()
+    total = 0
+    while True:
+        docs = await collection.find(
+            {"search_keys": {"$exists": False}},
+            {"username": 1, "displayName": 1}
+        ).limit(BACKFILL_BATCH).to_list(length=BACKFILL_BATCH)
+        if not docs:
+            break
+        await collection.bulk_write([
+            UpdateOne(
+                {"_id": doc["_id"]},
+                {"$set": {"search_keys": user_search_keys(doc.get("username", ""), doc.get("displayName", ""))}}
+            )
+            for doc in docs
+        ], ordered=False)
+        total += len(docs)
+    if total:
+        print(f"Search keys backfilled for {total} users")
+
+# Post and comment content search. Each document keeps its own postings:
+# search_terms holds the folded syllables of the text plus adjacent syllable
+# pairs ("học sinh" -> "hoc", "sinh", "hoc_sinh"), since Vietnamese words are
+# often two syllables. A multikey index on (search_terms, created_at, _id) is
+# the inverted index: it is updated with the document on create/edit, and
+# entries disappear with the document on delete.
+
+# Index entries per document. Distinct syllables come first and distinct pairs
+# fill the rest, so a long text only loses pairs (phrase matches) past the cap;
+# every word stays searchable up to MAX_CONTENT_TERMS distinct syllables.
+MAX_CONTENT_TERMS = 1000
+
+def _terms(tokens: List[str]) -> List[str]:
+    terms = list(dict.fromkeys(tokens))
+    terms += [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+    return list(dict.fromkeys(terms))
+
+def content_terms(text: str) -> List[str]:
+    # Deduplicated before the cap is applied
+    return _terms(tokenize(text))[:MAX_CONTENT_TERMS]
+
+def _visible_authors(viewer: User) -> List:
+    # Same audience as the feed: the viewer and their friends, minus blocks
+    blocked = set(to_object_ids(viewer.blocked_users))
+    return [oid for oid in [viewer.id] + to_object_ids(viewer.friends) if oid not in blocked]
+
+def _content_match(query: str) -> Optional[dict]:
+    tokens = _query_tokens(query)
+    if not tokens:
+        return None
+    return {"search_terms": {"$all": _terms(tokens)}}
+
+async def search_posts(viewer: User, query: str, limit: int, cursor: Optional[str] = None) -> List[Post]:
+    match = _content_match(query)
+    if match is None:
+        return []
+    match.update(link_in("author", _visible_authors(viewer)))
+    match.update(keyset_filter("created_at", cursor))
+    return await Post.find(match).sort([("created_at", -1), ("_id", -1)]).limit(limit).to_list()
+
+async def search_comments(viewer: User, query: str, limit: int, cursor: Optional[str] = None) -> List[Comment]:
+    match = _content_match(query)
+    if match is None:
+        return []
+    match["post_author_id"] = {"$in": _visible_authors(viewer)}
+    # Comments by blocked users on visible posts
+    blocked = to_object_ids(viewer.blocked_users)
+    if blocked:
+        match["author.$id"] = {"$nin": blocked}
+    match.update(keyset_filter("created_at", cursor))
+    return await Comment.find(match).sort([("created_at", -1), ("_id", -1)]).limit(limit).to_list()
+
+@jobs.handler("backfill_content_search_terms")
+async def backfill_content_search_terms():
+    # Posts and comments written before search_terms existed; runs at startup
+    posts = Post.get_motor_collection()
+    comments = Comment.get_motor_collection()
+    total = 0
+    while True:
+        docs = await posts.find(
+            {"search_terms": {"$exists": False}}, {"content": 1}
+        ).limit(BACKFILL_BATCH).to_list(length=BACKFILL_BATCH)
+        if not docs:
+            break
+        await posts.bulk_write([
+            UpdateOne({"_id": d["_id"]}, {"$set": {"search_terms": content_terms(d.get("content", ""))}})
+            for d in docs
+        ], ordered=False)
+        total += len(docs)
+    while True:
+        docs = await comments.find(
+            {"search_terms": {"$exists": False}}, {"content": 1, "post_id": 1}
+        ).limit(BACKFILL_BATCH).to_list(length=BACKFILL_BATCH)
+        if not docs:
+            break
+        authors: Dict = {
+            p["_id"]: p["author"].id
+            async for p in posts.find({"_id": {"$in": [d["post_id"] for d in docs]}}, {"author": 1})
+        }
+        await comments.bulk_write([
+            UpdateOne({"_id": d["_id"]}, {"$set": {
+                "search_terms": content_terms(d.get("content", "")),
+                "post_author_id": authors.get(d["post_id"]),
+            }})
+            for d in docs
+        ], ordered=False)
+        total += len(docs)
+    if total:
+        print(f"Search terms backfilled for {total} posts/comments")
@@ -0,0 +1,121 @@
+import hashlib
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from beanie import PydanticObjectId, UpdateResponse
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+
+from app.core import security
+from app.core.cache import user_cache
+from app.core.config import settings
+from app.core.links import to_object_id
+from app.core.realtime import manager
+from app.core.revocation import revocations
+from app.models.session import TokenFamily, RetiredRefreshToken
+
+# Refresh token rotation with reuse detection. Each login starts a token family;
+# /refresh atomically swaps the family's current jti for a new one. Presenting
+# an already rotated refresh token means it leaked (or the client is replaying
+# it), so the whole family is revoked, access tokens included.
+
+def _invalid(detail: str = "Invalid token") -> HTTPException:
+    return HTTPException(status_code=401, detail=detail)
+
+def _tokens(user_id, family_id: str, jti: str) -> dict:
+    return {
+        "access_token": security.create_access_token(user_id, family_id=family_id),
+        "refresh_token": security.create_refresh_token(user_id, family_id=family_id, jti=jti),
+        "token_type": "bearer",
+    }
+
+def _expires_at() -> datetime:
+    return datetime.utcnow() + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+
+async def start_session(user_id: PydanticObjectId) -> dict:
+    jti = uuid.uuid4().hex
+    family = TokenFamily(user_id=user_id, current_jti=jti, expires_at=_expires_at())
+    await family.create()
+    return _tokens(user_id, str(family.id), jti)
+
+async def rotate(refresh_token: str) -> dict:
+    try:
+        payload = security.jwt.decode(refresh_token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except security.JWTError:
+        raise _invalid()
+    if payload.get("type") != "refresh":
+        raise _invalid("Invalid token type")
+    user_id = to_object_id(payload.get("sub"))
+    if user_id is None:
+        raise _invalid()
+    if revocations.is_revoked(str(user_id), payload):
+        raise _invalid()
+    if await user_cache.get(user_id) is None:
+        raise _invalid("User not found")
+
+    family_id = to_object_id(payload.get("fam"))
+    jti = payload.get("jti")
+    if family_id is None or not jti:
+        # Issued before token families existed: move it onto a new family, once.
+        # The unique hash makes a second use (or a concurrent one) fail.
+        try:
+            await RetiredRefreshToken(
+                token_hash=hashlib.sha256(refresh_token.encode()).hexdigest(),
+                expires_at=datetime.utcfromtimestamp(payload["exp"])
+            ).create()
+        except DuplicateKeyError:
+            print(f"Legacy refresh token reused for user {user_id}")
+            raise _invalid()
+        return await start_session(user_id)
+
+    new_jti = uuid.uuid4().hex
+    now = datetime.utcnow()
+    family = await TokenFamily.find_one(
+        {"_id": family_id, "user_id": user_id, "current_jti": jti, "revoked": False}
+    ).update(
+        {"$set": {
+            "current_jti": new_jti,
+            "previous_jti": jti,
+            "rotated_at": now,
+            "expires_at": _expires_at(),
+        }},
+        response_type=UpdateResponse.NEW_DOCUMENT
+    )
+    if family:
+        return _tokens(user_id, str(family_id), new_jti)
+
+    family = await TokenFamily.get(family_id)
+    if family and not family.revoked and family.user_id == user_id:
+        grace = timedelta(seconds=settings.REFRESH_REUSE_GRACE_SECONDS)
+        if family.previous_jti == jti and family.rotated_at and now - family.rotated_at <= grace:
+            # Concurrent refreshes from the same client: refuse this one only
+            raise _invalid("Token already rotated")
+        print(f"Refresh token reuse detected for user {user_id}, revoking session {family_id}")
+        await revoke(family_id)
+    raise _invalid()
+
+async def revoke(family_id) -> bool:
+    oid = to_object_id(family_id)
+    if oid is None:
+        return False
+    result = await TokenFamily.find_one({"_id": oid, "revoked": False}).update(
+        {"$set": {"revoked": True, "revoked_at": datetime.utcnow()}}
+    )
+    revocations.revoke_family(oid)
+    manager.close_family(oid)
+    return bool(result and result.modified_count)
+
+async def revoke_all(user_id: PydanticObjectId, except_family: Optional[str] = None):
+    # e.g. after a password reset: every other device has to log in again
+    query = {"user_id": user_id, "revoked": False}
+    families = await TokenFamily.get_motor_collection().find(query, {"_id": 1}).to_list(length=None)
+    ids = [doc["_id"] for doc in families if str(doc["_id"]) != except_family]
+    if not ids:
+        return
+    await TokenFamily.find({"_id": {"$in": ids}}).update(
+        {"$set": {"revoked": True, "revoked_at": datetime.utcnow()}}
+    )
+    for family_id in ids:
+        revocations.revoke_family(family_id)
+        manager.close_family(family_id)
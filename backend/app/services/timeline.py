@@ -0,0 +1,186 @@
+from typing import List, Optional, Tuple
+from datetime import datetime
+from beanie import PydanticObjectId
+from pymongo.errors import BulkWriteError
+
+from app.core.cache import user_cache
+from app.core.config import settings
+from app.core.jobs import jobs
+from app.core.pagination import keyset_filter
+from app.core.links import link_eq, link_in, to_object_ids
+from app.models.post import Post
+from app.models.user import User
+from app.models.timeline import TimelineEntry
+
+# Fan-out-on-write: each post id is pushed into the timeline of the author and
+# every friend. Accounts with more than FEED_FANOUT_MAX_FRIENDS friends are not
+# fanned out; their posts are pulled at read time instead (fan-out-on-read).
+#
+# Users from before fan-out existed start with timeline_ready unset. Until the
+# backfill job has materialized their feed, reads pull from all friends.
+
+BACKFILL_BATCH = 200
+
+def is_large_account(user: User) -> bool:
+    return len(user.friends) > settings.FEED_FANOUT_MAX_FRIENDS
+
+def clamp_limit(limit: int) -> int:
+    return max(1, min(limit, settings.FEED_MAX_PAGE_SIZE))
+
+async def _insert_entries(entries: List[dict]):
+    if not entries:
+        return
+    try:
+        await TimelineEntry.get_motor_collection().insert_many(entries, ordered=False)
+    except BulkWriteError:
+        # Duplicate (owner_id, post_id) rows are expected on re-delivery
+        pass
+
+async def fan_out_post(post: Post, author: User):
+    owner_ids = [author.id]
+    if not is_large_account(author):
+        owner_ids.extend(to_object_ids(author.friends))
+
+    entries = [
+        {
+            "owner_id": owner_id,
+            "post_id": post.id,
+            "author_id": author.id,
+            "created_at": post.created_at,
+        }
+        for owner_id in owner_ids
+    ]
+    await _insert_entries(entries)
+
+async def backfill_from_author(owner: User, author: User):
+    # Called when a friendship is created so the new friend's recent posts show up
+    if is_large_account(author):
+        return
+    posts = await Post.find(
+        link_eq("author", author.id)
+    ).sort(-Post.created_at).limit(settings.FEED_BACKFILL_POSTS).to_list()
+    entries = [
+        {
+            "owner_id": owner.id,
+            "post_id": p.id,
+            "author_id": author.id,
+            "created_at": p.created_at,
+        }
+        for p in posts
+    ]
+    await _insert_entries(entries)
+
+async def remove_author_from_timeline(owner_id: PydanticObjectId, author_id: PydanticObjectId):
+    await TimelineEntry.find(
+        TimelineEntry.owner_id == owner_id,
+        TimelineEntry.author_id == author_id
+    ).delete()
+
+async def remove_post(post_id: PydanticObjectId):
+    await TimelineEntry.find(TimelineEntry.post_id == post_id).delete()
+
+async def _large_friend_ids(friend_ids: List[PydanticObjectId]) -> List[PydanticObjectId]:
+    if not friend_ids:
+        return []
+    # "friends.<n>" exists <=> len(friends) > n, so this never loads friend lists
+    large = await User.get_motor_collection().find(
+        {
+            "_id": {"$in": friend_ids},
+            f"friends.{settings.FEED_FANOUT_MAX_FRIENDS}": {"$exists": True},
+        },
+        {"_id": 1},
+    ).to_list(length=None)
+    return [doc["_id"] for doc in large]
+
+async def _materialize(owner_id: PydanticObjectId, friend_ids: List[PydanticObjectId]):
+    # The owner's own recent posts plus FEED_BACKFILL_POSTS from every friend
+    # that is fanned out on write; large accounts stay pulled at read time
+    large = set(await _large_friend_ids(friend_ids))
+    posts = Post.get_motor_collection()
+    for author_id in [owner_id] + [fid for fid in friend_ids if fid not in large]:
+        docs = await posts.find(
+            link_eq("author", author_id), {"_id": 1, "created_at": 1}
+        ).sort([("created_at", -1), ("_id", -1)]).limit(settings.FEED_BACKFILL_POSTS).to_list(
+            length=settings.FEED_BACKFILL_POSTS
+        )
+        await _insert_entries([
+            {
+                "owner_id": owner_id,
+                "post_id": doc["_id"],
+                "author_id": author_id,
+                "created_at": doc["created_at"],
+            }
+            for doc in docs
+        ])
+
+@jobs.handler("backfill_timelines")
+async def backfill_timelines():
+    # One-off migration for accounts created before fan-out; runs at startup
+    collection = User.get_motor_collection()
+    total = 0
+    while True:
+        docs = await collection.find(
+            {"timeline_ready": {"$ne": True}}, {"friends": 1}
+        ).limit(BACKFILL_BATCH).to_list(length=BACKFILL_BATCH)
+        if not docs:
+            break
+        for doc in docs:
+            await _materialize(doc["_id"], to_object_ids(doc.get("friends", [])))
+        ids = [doc["_id"] for doc in docs]
+        await collection.update_many({"_id": {"$in": ids}}, {"$set": {"timeline_ready": True}})
+        user_cache.invalidate(*ids)
+        total += len(docs)
+    if total:
+        print(f"Timelines backfilled for {total} users")
+
+async def _pull_posts(author_ids: List[PydanticObjectId], count: int, cursor: Optional[str] = None) -> List[dict]:
+    if not author_ids or count <= 0:
+        return []
+    query = link_in("author", author_ids)
+    query.update(keyset_filter("created_at", cursor))
+    docs = Post.get_motor_collection().find(
+        query,
+        {"_id": 1, "created_at": 1},
+    ).sort([("created_at", -1), ("_id", -1)]).limit(count)
+    return [
+        {"post_id": doc["_id"], "created_at": doc["created_at"]}
+        for doc in await docs.to_list(length=count)
+    ]
+
+async def read_timeline(
+    user: User,
+    skip: int = 0,
+    limit: int = 20,
+    cursor: Optional[str] = None
+) -> List[Tuple[PydanticObjectId, datetime]]:
+    # Returns (post_id, created_at) pairs, newest first. With a cursor, skip is ignored.
+    limit = clamp_limit(limit)
+    if cursor:
+        skip = 0
+    window = skip + limit
+
+    query = {"owner_id": user.id}
+    query.update(keyset_filter("created_at", cursor, id_field="post_id"))
+    pushed = await TimelineEntry.get_motor_collection().find(
+        query,
+        {"_id": 0, "post_id": 1, "created_at": 1},
+    ).sort([("created_at", -1), ("post_id", -1)]).limit(window).to_list(length=window)
+
+    if user.timeline_ready:
+        pull_authors = await _large_friend_ids(to_object_ids(user.friends))
+    else:
+        # Not backfilled yet: rows pushed since deploy don't cover older posts,
+        # so read straight from friends' posts as well
+        pull_authors = [user.id] + to_object_ids(user.friends)
+
+    pulled = await _pull_posts(pull_authors, window, cursor)
+
+    merged = {}
+    for entry in pushed + pulled:
+        merged.setdefault(entry["post_id"], entry["created_at"])
+    ordered = sorted(
+        merged.items(),
+        key=lambda item: (item[1] or datetime.min, item[0]),
+        reverse=True
+    )
+    return ordered[skip:window]
@@ -0,0 +1,165 @@
+from typing import Dict, Iterable, List, Optional
+
+from beanie import PydanticObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.jobs import jobs
+from app.core.links import link_eq, to_object_id, to_object_ids
+from app.core.realtime import manager, encode_frame
+from app.models.message import Conversation
+from app.models.notification import Notification
+from app.models.unread import UnreadCounter
+
+# Unread badges. Counters live in unread_counters (one row per user) and are
+# changed with atomic updates when notifications/messages are created or read.
+# Every change bumps the row's version and is pushed to the user's devices as
+# an "unread_counts" event, so clients don't need to poll. Each process keeps
+# the latest counts per user in memory, fed by those same events (the
+# backplane brings them from other workers), so a poll is served without a
+# database read.
+#
+# Users without a counter row yet get one built from the collections on first
+# read. Increments land on the row while it is being built and are kept.
+
+_cache = TTLCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.UNREAD_CACHE_TTL_SECONDS)
+
+def _counts(doc: Optional[dict]) -> dict:
+    conversations = {k: v for k, v in (doc or {}).get("conversations", {}).items() if v > 0}
+    return {
+        "notifications": max(0, (doc or {}).get("notifications", 0)),
+        "conversations": conversations,
+        "conversationsTotal": len(conversations),
+        "version": (doc or {}).get("version", 0),
+    }
+
+def _remember(user_ids: List[str], counts: dict):
+    # Events from different workers can arrive out of order; keep the newest
+    for oid in to_object_ids(user_ids):
+        cached = _cache.get(oid)
+        if cached is None or cached["version"] <= counts.get("version", 0):
+            _cache.set(oid, counts)
+
+manager.subscribe("unread_counts", _remember)
+
+def _collection():
+    return UnreadCounter.get_motor_collection()
+
+async def _build(user_id: PydanticObjectId) -> dict:
+    try:
+        # From here on increments apply to the row, initialized or not
+        await _collection().update_one(
+            {"_id": user_id},
+            {"$setOnInsert": {"notifications": 0, "conversations": {}, "initialized": False, "version": 0}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        pass
+    for _ in range(3):
+        before = await _collection().find_one({"_id": user_id})
+        if before.get("initialized"):
+            return before
+        notifications = await Notification.find(
+            {**link_eq("recipient", user_id), "is_read": False}
+        ).count()
+        unseen = await Conversation.get_motor_collection().find(
+            {
+                **link_eq("participants", user_id),
+                "last_message": {"$ne": None},
+                "seen_ids": {"$ne": str(user_id)},
+            },
+            {"_id": 1}
+        ).to_list(length=None)
+        after = await _collection().find_one({"_id": user_id})
+        if after.get("initialized"):
+            return after
+
+        # The counts above plus whatever was added while they ran. Per-message
+        # counts aren't recoverable from seen_ids: one per unseen conversation.
+        conversations = {str(c["_id"]): 1 for c in unseen}
+        old = before.get("conversations", {})
+        for key, value in after.get("conversations", {}).items():
+            conversations[key] = conversations.get(key, 0) + value - old.get(key, 0)
+        doc = {
+            "notifications": notifications + after.get("notifications", 0) - before.get("notifications", 0),
+            "conversations": conversations,
+            "initialized": True,
+            "version": after.get("version", 0) + 1,
+        }
+        # Only if nothing changed since the second read; otherwise count again
+        result = await _collection().update_one(
+            {"_id": user_id, "initialized": False, "version": after.get("version", 0)},
+            {"$set": doc}
+        )
+        if result.modified_count:
+            return doc
+    return await _collection().find_one({"_id": user_id})
+
+async def get_counts(user_id) -> dict:
+    oid = to_object_id(user_id)
+    if oid is None:
+        return _counts(None)
+    counts = _cache.get(oid)
+    if counts is None:
+        doc = await _collection().find_one({"_id": oid, "initialized": True})
+        counts = _counts(doc or await _build(oid))
+        _remember([str(oid)], counts)
+    return counts
+
+async def _publish(user_id: PydanticObjectId, doc: Optional[dict]):
+    # Rows still being built have nothing to show yet
+    if doc is None or not doc.get("initialized"):
+        return
+    await manager.send_personal_message(encode_frame("unread_counts", _counts(doc)), str(user_id))
+
+def _versioned(update):
+    if isinstance(update, list):
+        return update + [{"$set": {"version": {"$add": [{"$ifNull": ["$version", 0]}, 1]}}}]
+    return {**update, "$inc": {**update.get("$inc", {}), "version": 1}}
+
+async def _update(user_id, update) -> None:
+    oid = to_object_id(user_id)
+    if oid is None:
+        return
+    doc = await _collection().find_one_and_update(
+        {"_id": oid},
+        _versioned(update),
+        return_document=ReturnDocument.AFTER
+    )
+    await _publish(oid, doc)
+
+async def add_notifications(user_id, delta: int = 1):
+    # Pipeline update so the counter never goes below zero
+    await _update(user_id, [{"$set": {
+        "notifications": {"$max": [0, {"$add": [{"$ifNull": ["$notifications", 0]}, delta]}]}
+    }}])
+
+async def reset_notifications(user_id):
+    await _update(user_id, {"$set": {"notifications": 0}})
+
+async def add_messages(conversation_id: str, user_ids: Iterable):
+    # Called on the send path: the counter writes and the per-recipient pushes
+    # of a large group would otherwise hold up the HTTP response / socket ack
+    user_ids = [str(uid) for uid in user_ids]
+    if user_ids:
+        await jobs.enqueue("unread_messages", conversation_id=conversation_id, user_ids=user_ids)
+
+@jobs.handler("unread_messages")
+async def count_messages(conversation_id: str, user_ids: List[str]):
+    oids: List[PydanticObjectId] = to_object_ids(user_ids)
+    if not oids:
+        return
+    await _collection().update_many(
+        {"_id": {"$in": oids}},
+        _versioned({"$inc": {f"conversations.{conversation_id}": 1}})
+    )
+    docs: Dict[PydanticObjectId, dict] = {
+        doc["_id"]: doc async for doc in _collection().find({"_id": {"$in": oids}})
+    }
+    for oid in oids:
+        await _publish(oid, docs.get(oid))
+
+async def reset_conversation(user_id, conversation_id: str):
+    await _update(user_id, {"$unset": {f"conversations.{conversation_id}": ""}})
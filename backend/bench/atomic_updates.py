@@ -0,0 +1,169 @@
+# Concurrency benchmark for the read-modify-save paths replaced by targeted
+# updates. Each scenario fires N concurrent requests at one document, first the
+# old way (get, mutate, save(), i.e. a full-document replace) and then with the
+# $inc / $addToSet the routers use now, and reports lost updates and the bytes
+# each request sends to MongoDB for its write.
+#
+#   comments_count  create_comment on one post
+#   seen_ids        mark_as_seen by N participants of one group conversation
+#   friends         N users accepting a friend request from the same user
+#
+# Uses a separate "<MONGODB_DB_NAME>_bench" database, dropped afterwards.
+# Run from backend/ (reads .env like the app):
+#   python -m bench.atomic_updates [--requests 200]
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bson  # noqa: E402
+from beanie import PydanticObjectId, UpdateResponse, init_beanie  # noqa: E402
+from beanie.odm.utils.encoder import Encoder  # noqa: E402
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+
+from app.core.config import settings  # noqa: E402
+from app.models.message import Conversation, Message  # noqa: E402
+from app.models.post import Post, Reaction  # noqa: E402
+from app.models.reaction import PostReaction  # noqa: E402
+from app.models.user import User  # noqa: E402
+
+def _size(document) -> int:
+    # What save() sends: the whole encoded document
+    return len(bson.encode(Encoder(by_alias=True).encode(document)))
+
+def _update_size(update: dict) -> int:
+    return len(bson.encode(update))
+
+async def seed_post(author: User) -> Post:
+    post = Post(
+        content="Bench post " + "lorem ipsum dolor sit amet " * 80,
+        author=author,
+        image_urls=[f"http://localhost:8000/static/media/{'a' * 64}.jpg"] * 4,
+        reactions=[Reaction(user_id=str(PydanticObjectId()), type="like") for _ in range(50)],
+    )
+    await post.create()
+    return post
+
+async def seed_user(name: str) -> User:
+    user = User(
+        username=name,
+        email=f"{name}@bench.local",
+        password_hash="x" * 60,
+        display_name=name,
+        friends=[str(PydanticObjectId()) for _ in range(100)],
+    )
+    await user.create()
+    return user
+
+# comments_count
+
+async def legacy_comment(post_id, sizes):
+    post = await Post.get(post_id)
+    post.comments_count += 1
+    sizes.append(_size(post))
+    await post.save()
+
+async def atomic_comment(post_id, sizes):
+    update = {"$inc": {"comments_count": 1}}
+    sizes.append(_update_size(update))
+    await Post.find_one({"_id": post_id}).update(update, response_type=UpdateResponse.NEW_DOCUMENT)
+
+async def comments_result(post_id) -> int:
+    return (await Post.get(post_id)).comments_count
+
+# seen_ids
+
+async def legacy_seen(conv_id, user_id, sizes):
+    conv = await Conversation.get(conv_id)
+    if user_id not in conv.seen_ids:
+        conv.seen_ids.append(user_id)
+    sizes.append(_size(conv))
+    await conv.save()
+
+async def atomic_seen(conv_id, user_id, sizes):
+    update = {"$addToSet": {"seen_ids": user_id}}
+    sizes.append(_update_size(update))
+    await Conversation.find_one({"_id": conv_id}).update(update)
+
+async def seen_result(conv_id) -> int:
+    return len((await Conversation.get(conv_id)).seen_ids)
+
+# friends
+
+async def legacy_friend(user_id, friend_id, sizes):
+    user = await User.get(user_id)
+    if friend_id not in user.friends:
+        user.friends.append(friend_id)
+    sizes.append(_size(user))
+    await user.save()
+
+async def atomic_friend(user_id, friend_id, sizes):
+    update = {"$addToSet": {"friends": friend_id}}
+    sizes.append(_update_size(update))
+    await User.find_one({"_id": user_id}).update(update)
+
+async def friends_result(user_id, before: int) -> int:
+    return len((await User.get(user_id)).friends) - before
+
+async def scenario(label: str, n: int, make_request, result):
+    sizes = []
+    start = time.perf_counter()
+    await asyncio.gather(*(make_request(i, sizes) for i in range(n)))
+    elapsed = (time.perf_counter() - start) * 1000
+    applied = await result()
+    avg = sum(sizes) / len(sizes) if sizes else 0
+    print(f"{label:<24} applied {applied:>5}/{n:<5} lost {n - applied:>5} | {avg:>8.0f} B/request | {elapsed:8.1f} ms")
+
+async def run(n: int):
+    client = AsyncIOMotorClient(settings.MONGODB_URL)
+    db_name = f"{settings.MONGODB_DB_NAME}_bench"
+    await client.drop_database(db_name)
+    await init_beanie(
+        database=client[db_name],
+        document_models=[User, Post, Conversation, Message, PostReaction]
+    )
+    print(f"{n} concurrent requests per scenario against {db_name}")
+    try:
+        author = await seed_user("bench_author")
+        participants = [PydanticObjectId() for _ in range(n)]
+        for mode, comment, seen, friend in (
+            ("legacy save()", legacy_comment, legacy_seen, legacy_friend),
+            ("atomic update", atomic_comment, atomic_seen, atomic_friend),
+        ):
+            post = await seed_post(author)
+            await scenario(
+                f"comments_count {mode}", n,
+                lambda i, sizes: comment(post.id, sizes),
+                lambda: comments_result(post.id)
+            )
+
+            conv = Conversation(is_group=True, participants=[author])
+            await conv.create()
+            await scenario(
+                f"seen_ids {mode}", n,
+                lambda i, sizes: seen(conv.id, str(participants[i]), sizes),
+                lambda: seen_result(conv.id)
+            )
+
+            popular = await seed_user(f"bench_popular_{mode.split()[0]}")
+            before = len(popular.friends)
+            await scenario(
+                f"friends {mode}", n,
+                lambda i, sizes: friend(popular.id, str(participants[i]), sizes),
+                lambda: friends_result(popular.id, before)
+            )
+    finally:
+        await client.drop_database(db_name)
+        client.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Lost-update benchmark for atomic partial updates")
+    parser.add_argument("--requests", type=int, default=200, help="concurrent requests per scenario")
+    asyncio.run(run(parser.parse_args().requests))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+# Regression benchmark for empty-result profile and inbox reads: a user with no
+# posts / no conversations must cost the same on a 100k-post database as on an
+# empty one. Seeds a separate "<MONGODB_DB_NAME>_bench" database in steps and,
+# at each size, times the exact queries get_user_posts and get_conversations
+# issue for a user that owns nothing, plus how many documents the server read.
+#
+# --legacy also times the removed fallback (load every post with its links and
+# filter in Python), which grows with the collection.
+#
+# Run from backend/ (reads .env like the app):
+#   python -m bench.empty_queries [--sizes 10000 50000 100000] [--runs 50] [--legacy] [--keep]
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from beanie import PydanticObjectId, init_beanie  # noqa: E402
+from bson import DBRef  # noqa: E402
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+
+from app.core.config import settings  # noqa: E402
+from app.core.indexes import sync_indexes  # noqa: E402
+from app.core.links import link_eq  # noqa: E402
+from app.models.message import Conversation, Message  # noqa: E402
+from app.models.post import Post  # noqa: E402
+from app.models.reaction import PostReaction  # noqa: E402
+from app.models.user import User  # noqa: E402
+
+AUTHORS = 1000
+BATCH = 5000
+PAGE = 20
+
+def post_docs(count: int, authors, now: datetime):
+    for i in range(count):
+        yield {
+            "content": f"bench post {i}",
+            "author": DBRef("users", random.choice(authors)),
+            "image_urls": [],
+            "file_urls": [],
+            "video_urls": [],
+            "reactions": [],
+            "reaction_counts": {},
+            "comments_count": 0,
+            "search_terms": [],
+            "created_at": now - timedelta(seconds=i),
+            "updated_at": now - timedelta(seconds=i),
+        }
+
+def conversation_docs(count: int, authors, now: datetime):
+    for i in range(count):
+        a, b = random.sample(authors, 2)
+        yield {
+            "is_group": False,
+            "participants": [DBRef("users", a), DBRef("users", b)],
+            "updated_at": now - timedelta(seconds=i),
+            "muted_by": [],
+            "seen_ids": [],
+        }
+
+async def insert(collection, docs):
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) >= BATCH:
+            await collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await collection.insert_many(batch, ordered=False)
+
+async def timed(fn, runs: int):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), max(samples)
+
+async def docs_examined(cursor) -> int:
+    plan = await cursor.explain()
+    return plan.get("executionStats", {}).get("totalDocsExamined", -1)
+
+async def measure(size: int, runs: int, legacy: bool):
+    nobody = PydanticObjectId()
+    posts = Post.get_motor_collection()
+    conversations = Conversation.get_motor_collection()
+
+    async def user_posts():
+        # get_user_posts
+        return await Post.find(
+            link_eq("author", nobody)
+        ).sort([("created_at", -1), ("_id", -1)]).limit(PAGE).to_list()
+
+    async def inbox():
+        # get_conversations
+        return await Conversation.find(
+            link_eq("participants", nobody), fetch_links=True
+        ).sort(-Conversation.updated_at).to_list()
+
+    async def fallback():
+        # The pre-fix path, only reached because the result above was empty
+        everything = await Post.find_all(fetch_links=True).to_list()
+        return [p for p in everything if p.author and p.author.id == nobody]
+
+    posts_ms, posts_max = await timed(user_posts, runs)
+    inbox_ms, inbox_max = await timed(inbox, runs)
+    posts_read = await docs_examined(
+        posts.find(link_eq("author", nobody)).sort([("created_at", -1), ("_id", -1)]).limit(PAGE)
+    )
+    inbox_read = await docs_examined(
+        conversations.find(link_eq("participants", nobody)).sort("updated_at", -1)
+    )
+    line = (
+        f"{size:>8} | posts {posts_ms:7.2f} ms (max {posts_max:6.2f}, docs read {posts_read})"
+        f" | inbox {inbox_ms:7.2f} ms (max {inbox_max:6.2f}, docs read {inbox_read})"
+    )
+    if legacy:
+        legacy_ms, _ = await timed(fallback, 1)
+        line += f" | legacy fallback {legacy_ms:9.1f} ms"
+    print(line)
+
+async def run(args):
+    client = AsyncIOMotorClient(settings.MONGODB_URL)
+    db_name = f"{settings.MONGODB_DB_NAME}_bench"
+    database = client[db_name]
+    models = [User, Post, Conversation, Message, PostReaction]
+    await client.drop_database(db_name)
+    await init_beanie(database=database, document_models=models)
+    await sync_indexes(models)
+
+    authors = [PydanticObjectId() for _ in range(AUTHORS)]
+    now = datetime.now()
+    seeded = 0
+    print(f"Seeding {db_name}; median of {args.runs} runs per query, empty result each time")
+    try:
+        for size in sorted(args.sizes):
+            await insert(Post.get_motor_collection(), post_docs(size - seeded, authors, now))
+            # About one conversation per ten posts
+            await insert(Conversation.get_motor_collection(), conversation_docs((size - seeded) // 10, authors, now))
+            seeded = size
+            await measure(size, args.runs, args.legacy)
+    finally:
+        if not args.keep:
+            await client.drop_database(db_name)
+        client.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Empty-result query benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 100000], help="post counts to measure at")
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--legacy", action="store_true", help="also time the removed full-collection fallback")
+    parser.add_argument("--keep", action="store_true", help="keep the bench database afterwards")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
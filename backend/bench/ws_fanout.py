@@ -0,0 +1,115 @@
+# WebSocket fan-out micro-benchmark: per-recipient cost of delivering one chat
+# event to 10, 100 and 1000 recipients. No database or network; sockets are
+# stubs that accept frames instantly. Every column is timed until the last
+# frame has been handed to send_text.
+#
+#   legacy      json.dumps per recipient, then an awaited send_text each (the
+#               pre-broadcast send path)
+#   encode once encode_frame once, then the same awaited send_text loop: the
+#               encoding saving on its own, like for like with legacy
+#   broadcast   encode_frame once, ConnectionManager.deliver_local enqueues it
+#               and the per-connection writer tasks send it (what
+#               chat.post_message does); includes the queue and task overhead
+#               that buys isolation from slow sockets
+#
+# Run from backend/ (reads .env like the app):  python -m bench.ws_fanout [--rounds 200]
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.realtime import ConnectionManager, encode_frame  # noqa: E402
+
+RECIPIENTS = (10, 100, 1000)
+
+class StubSocket:
+    def __init__(self):
+        self.frames = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        self.frames += 1
+
+    async def close(self, code: int = 1000):
+        pass
+
+def sample_payload() -> dict:
+    return {
+        "message": {
+            "id": "6710f3a2c9e77b1d2a4f9c01",
+            "conversationId": "6710f3a2c9e77b1d2a4f9b77",
+            "senderId": "6710f3a2c9e77b1d2a4f9a10",
+            "senderName": "Nguyễn Văn An",
+            "senderAvatar": "http://10.0.2.2:8000/static/media/" + "a" * 64 + ".jpg",
+            "type": "text",
+            "content": {"text": "Tối nay 7 giờ họp nhóm ở thư viện nhé, nhớ mang laptop!"},
+            "fileUrls": [],
+            "timestamp": "2026-10-17T18:47:56.123456",
+        },
+        "conversation": {"participantCount": 1000},
+    }
+
+async def bench_legacy(sockets, payload: dict, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for ws in sockets:
+            await ws.send_text(json.dumps({"type": "new_message", "payload": payload}, default=str))
+    return time.perf_counter() - start
+
+async def bench_encode_once(sockets, payload: dict, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        frame = encode_frame("new_message", payload)
+        for ws in sockets:
+            await ws.send_text(frame)
+    return time.perf_counter() - start
+
+async def bench_broadcast(manager: ConnectionManager, user_ids, payload: dict, rounds: int) -> float:
+    metrics = manager.metrics
+    start = time.perf_counter()
+    for _ in range(rounds):
+        target = metrics.sent + metrics.dropped + len(user_ids)
+        await manager.deliver_local(user_ids, encode_frame("new_message", payload))
+        # Until every writer task has sent its frame
+        while metrics.sent + metrics.dropped < target:
+            await asyncio.sleep(0)
+    return time.perf_counter() - start
+
+async def run(rounds: int):
+    payload = sample_payload()
+    print(f"{'recipients':>10} {'legacy us/rcpt':>15} {'encode once us/rcpt':>20} {'broadcast us/rcpt':>18}")
+    for count in RECIPIENTS:
+        manager = ConnectionManager()
+        user_ids = [f"user-{i}" for i in range(count)]
+        sockets = []
+        for user_id in user_ids:
+            ws = StubSocket()
+            await manager.connect(ws, user_id)
+            sockets.append(ws)
+
+        # Fewer rounds for large groups keeps each run around the same length
+        n = max(1, rounds * 10 // count)
+        legacy = await bench_legacy(sockets, payload, n)
+        encode_once = await bench_encode_once(sockets, payload, n)
+        broadcast = await bench_broadcast(manager, user_ids, payload, n)
+        per = [elapsed / (n * count) * 1e6 for elapsed in (legacy, encode_once, broadcast)]
+        print(f"{count:>10} {per[0]:>15.2f} {per[1]:>20.2f} {per[2]:>18.2f}")
+
+        for conn in list(manager.active_connections.values()):
+            conn.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket fan-out micro-benchmark")
+    parser.add_argument("--rounds", type=int, default=200, help="rounds at 10 recipients, scaled down for larger groups")
+    args = parser.parse_args()
+    asyncio.run(run(args.rounds))
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,32 @@
+import os
 from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 from motor.motor_asyncio import AsyncIOMotorClient
 from beanie import init_beanie
 
 from app.core.config import settings
+from app.core.pagination import NEXT_CURSOR_HEADER
+from app.core.static import MediaStaticFiles
+from app.core.indexes import sync_indexes, report_collection_scans
+from app.core.cache import user_cache
+from app.core.realtime import manager
+from app.core.backplane import create_backplane
+from app.core.jobs import jobs
+from app.core.security import hash_metrics
+from app.core.deps import token_cache
+from app.core.revocation import revocations
+from app.services import images
 from app.models.user import User
 from app.models.post import Post
 from app.models.message import Message, Conversation
 from app.models.notification import Notification
 from app.models.friend_request import FriendRequest
 from app.models.comment import Comment
+from app.models.timeline import TimelineEntry
+from app.models.reaction import PostReaction
+from app.models.unread import UnreadCounter
+from app.models.session import TokenFamily, RetiredRefreshToken
 
 from app.routers import auth, users, posts, messages, notifications
 
@@ -22,22 +37,47 @@ async def lifespan(app: FastAPI):
     app.mongodb_db = app.mongodb_client[settings.MONGODB_DB_NAME]
     
     print(f"Connecting to MongoDB at: {settings.MONGODB_URL.split('@')[-1]}") # Log host only for safety
+    document_models = [
+        User,
+        Post,
+        Message,
+        Conversation,
+        Notification,
+        FriendRequest,
+        Comment,
+        TimelineEntry,
+        PostReaction,
+        UnreadCounter,
+        TokenFamily,
+        RetiredRefreshToken
+    ]
     await init_beanie(
         database=app.mongodb_db,
-        document_models=[
-            User,
-            Post,
-            Message,
-            Conversation,
-            Notification,
-            FriendRequest,
-            Comment
-        ]
+        document_models=document_models
     )
     print("Beanie initialized successfully!")
+
+    built = await sync_indexes(document_models)
+    if built:
+        print(f"Built missing indexes: {', '.join(built)}")
+    if settings.INDEX_SCAN_REPORT:
+        for scan in await report_collection_scans():
+            print(f"WARNING: query still uses a collection scan -> {scan}")
+    await manager.start(create_backplane(app.mongodb_db))
+    await jobs.start(app.mongodb_db)
+    await jobs.enqueue("backfill_timelines")
+    await jobs.enqueue("backfill_user_search_keys")
+    await jobs.enqueue("backfill_content_search_terms")
+    await revocations.start()
+    print(f"WebSocket backplane: {settings.WS_BACKPLANE}")
+
     print("Database connected and app is ready!")
     yield
     # Shutdown
+    await revocations.stop()
+    await jobs.stop()
+    await manager.stop()
+    images.shutdown()
     app.mongodb_client.close()
 
 app = FastAPI(
@@ -53,6 +93,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 app.include_router(auth.router, prefix=f"{settings.API_V1_STR}/auth", tags=["auth"])
@@ -62,8 +103,19 @@ app.include_router(messages.router, prefix=f"{settings.API_V1_STR}/messages", ta
 app.include_router(messages.router, prefix="/websocket", tags=["websocket"])
 app.include_router(notifications.router, prefix=f"{settings.API_V1_STR}/notifications", tags=["notifications"])
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
+app.mount("/static", MediaStaticFiles(directory=settings.MEDIA_ROOT), name="static")
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to Relo API"}
+
+@app.get("/stats")
+async def stats():
+    return {
+        "user_cache": user_cache.stats(),
+        "token_cache": token_cache.stats(),
+        "websocket": manager.stats(),
+        "jobs": jobs.stats(),
+        "password_hash": hash_metrics.snapshot()
+    }
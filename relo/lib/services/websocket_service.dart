@@ -196,6 +196,11 @@ class WebSocketService {
       _channel!.stream.listen(
         (data) {
           try {
+            // Trả lời heartbeat của server, không đẩy ping vào stream
+            if (_isPing(data)) {
+              send({'type': 'pong'});
+              return;
+            }
             // Wrap in try-catch to prevent crashes from unhandled messages
             if (!_streamController.isClosed) {
               _streamController.add(data);
@@ -238,6 +243,16 @@ class WebSocketService {
     }
   }
 
+  bool _isPing(dynamic data) {
+    if (data is! String || !data.contains('"ping"')) return false;
+    try {
+      final decoded = jsonDecode(data);
+      return decoded is Map && decoded['type'] == 'ping';
+    } catch (e) {
+      return false;
+    }
+  }
+
   void send(dynamic data) {
     if (_channel != null) {
       _channel!.sink.add(jsonEncode(data));